@@ -0,0 +1,302 @@
+#! /usr/bin/env python
+"""
+Benchmarks the compiler and the programs it generates.
+
+Every workload is a generated .src program that stresses one part of the
+compiler or the generated code: deep recursion, large arrays, long
+expressions and many procedures. For each one the time to compile it to C
+(reported as source lines per second) and the run time of the resulting
+binary are measured and compared against the saved baseline.
+
+usage (from the top of the repository):
+
+    python bench/bench.py                 compare against bench/baseline.json
+    python bench/bench.py --save          store the results as the new baseline
+    python bench/bench.py -O 2 -n         benchmark another configuration
+    python bench/bench.py --compact       benchmark C code without comments
+    python bench/bench.py --vm            benchmark the interpreter instead of gcc
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from cStringIO import StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.scanner import Scanner
+from src.parser import Parser
+from src.gen import Gen
+from src.native import NativeGen
+from src.vm import VM
+
+"""
+Workloads
+"""
+
+def recursion(scale):
+    # each frame takes 5 words of the 10000 word M[] stack
+    depth = min(1000 * scale, 1500)
+    reps = 20000 * scale
+    return """program bench_recursion is
+    integer i;
+    integer y;
+    integer total;
+    global procedure down(integer n in, integer z out)
+        integer y;
+    begin
+        if (n == 0) then
+            z := 0;
+        else
+            down(n - 1, y);
+            z := y + 1;
+        end if;
+    end procedure;
+begin
+    total := 0;
+    i := 0;
+    for (i := i + 1; i <= %d)
+        down(%d, y);
+        total := total + y;
+    end for;
+    putInteger(total);
+end program;
+""" % (reps, depth)
+
+def arrays(scale):
+    size = min(2000 * scale, 9000)
+    reps = 10000 * scale
+    return """program bench_arrays is
+    global integer a[%d];
+    integer i;
+    integer j;
+    integer total;
+begin
+    total := 0;
+    j := 0;
+    for (j := j + 1; j <= %d)
+        i := -1;
+        for (i := i + 1; i < %d)
+            a[i] := i + j;
+        end for;
+        i := -1;
+        for (i := i + 1; i < %d)
+            total := total + a[i] - j;
+        end for;
+    end for;
+    putInteger(total);
+end program;
+""" % (size, reps, size, size)
+
+def expressions(scale):
+    terms = 200 * scale
+    reps = 200000 * scale
+    expr = " +\n            ".join("(i * %d - x) / %d" % (k % 7 + 1, k % 5 + 1) for k in range(terms))
+    return """program bench_expressions is
+    integer i;
+    integer x;
+begin
+    x := 0;
+    i := 0;
+    for (i := i + 1; i <= %d)
+        x := %s;
+    end for;
+    putInteger(x);
+end program;
+""" % (reps, expr)
+
+def procedures(scale):
+    count = 300 * scale
+    reps = 20000 * scale
+    procs = []
+    for k in range(count):
+        procs.append("""    global procedure p%d(integer x in, integer y out)
+    begin
+        y := x + %d;
+    end procedure;
+""" % (k, k))
+    calls = "".join("        p%d(x, x);\n" % k for k in range(count))
+    return """program bench_procedures is
+    integer i;
+    integer x;
+%sbegin
+    x := 0;
+    i := 0;
+    for (i := i + 1; i <= %d)
+%s    end for;
+    putInteger(x);
+end program;
+""" % ("".join(procs), reps, calls)
+
+WORKLOADS = [
+    ('recursion', recursion),
+    ('arrays', arrays),
+    ('expressions', expressions),
+    ('procedures', procedures),
+]
+
+"""
+Measurements
+"""
+
+def compile_source(s_filename, c_filename, args):
+    """
+    Compiles s_filename to c_filename in process, or assembles it for the
+    interpreter with --vm. Returns the code generator and the time it took,
+    the best of args.repeat runs.
+    """
+    best = None
+    for i in range(args.repeat):
+        start = time.time()
+        if args.vm:
+            gen = VM()
+        else:
+            gen = NativeGen(compact=args.compact) if args.native else Gen(compact=args.compact)
+        scanner = Scanner(s_filename)
+        parser = Parser(scanner, gen)
+        if scanner.has_errors or parser.has_errors:
+            raise Exception("%s does not compile" % s_filename)
+        gen.optimize(args.opt_level)
+        if args.vm:
+            gen.assemble()
+        else:
+            gen.write_file(c_filename)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return gen, best
+
+def build(c_filename, o_filename, args):
+    cmd = ['gcc'] + args.cflags.split() + ['-O%d' % args.opt_level, '-w', '-o', o_filename, '-I', 'runtime', 'runtime/runtime.c', c_filename]
+    if subprocess.call(cmd) != 0:
+        raise Exception("gcc failed on %s" % c_filename)
+
+def run(o_filename, args):
+    """
+    Runs the binary and returns its output and run time, the best of
+    args.repeat runs
+    """
+    best = None
+    for i in range(args.repeat):
+        start = time.time()
+        output = subprocess.check_output([o_filename])
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return output, best
+
+def interpret(vm, args):
+    """
+    Runs the program in the interpreter, returns its output and run time,
+    the best of args.repeat runs
+    """
+    best = None
+    for i in range(args.repeat):
+        stdout = StringIO()
+        start = time.time()
+        if vm.run(stdout=stdout) != 0:
+            raise Exception("the program failed")
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return stdout.getvalue(), best
+
+def change(new, old):
+    if not old:
+        return ""
+    return "%+6.1f%%" % ((new - old) * 100.0 / old)
+
+def main():
+
+    argparser = argparse.ArgumentParser(description='EECS 6083 Compiler benchmarks')
+    argparser.add_argument('-O', dest='opt_level', type=int, choices=[0, 1, 2], default=1, help='optimization level (default: 1)')
+    argparser.add_argument('-n', '--native', action='store_true', help='benchmark the native code generator')
+    argparser.add_argument('--compact', action='store_true', help='generate C code without comments')
+    argparser.add_argument('--vm', action='store_true', help='run the programs in the interpreter')
+    argparser.add_argument('-s', '--scale', type=int, default=1, help='multiply the size of every workload')
+    argparser.add_argument('-r', '--repeat', type=int, default=3, help='take the best of this many runs (default: 3)')
+    argparser.add_argument('--cflags', default='-m32', help='extra gcc flags (default: -m32)')
+    argparser.add_argument('--only', metavar='NAME', help='only run the named workload')
+    argparser.add_argument('--save', action='store_true', help='store the results in the baseline file')
+    argparser.add_argument('--baseline', default=os.path.join(ROOT, 'bench', 'baseline.json'), help='baseline file')
+    argparser.add_argument('--workdir', default=os.path.join(ROOT, 'bench', 'build'), help='where to put the generated programs')
+    args = argparser.parse_args()
+
+    # gcc is given the runtime relative to the repository root
+    os.chdir(ROOT)
+
+    if not os.path.isdir(args.workdir):
+        os.makedirs(args.workdir)
+
+    if args.vm and (args.native or args.compact):
+        argparser.error("--vm does not generate C, it cannot be combined with -n or --compact")
+
+    config = "O%d%s%s%s-x%d" % (args.opt_level, "-native" if args.native else "", "-compact" if args.compact else "", "-vm" if args.vm else "", args.scale)
+
+    # run times of different toolchains cannot be compared
+    if not args.vm:
+        config += " " + " ".join(args.cflags.split())
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    baseline = baselines.get(config, {})
+
+    print "configuration: %s" % config
+    print "%-12s %7s %12s %8s %10s %8s  %s" % ("workload", "lines", "lines/sec", "", "run (ms)", "", "output")
+    print "-"*78
+
+    results = {}
+
+    for name, workload in WORKLOADS:
+
+        if args.only and name != args.only:
+            continue
+
+        source = workload(args.scale)
+        s_filename = os.path.join(args.workdir, name + '.src')
+        c_filename = os.path.join(args.workdir, name + '.c')
+        o_filename = os.path.join(args.workdir, name)
+
+        with open(s_filename, 'w') as f:
+            f.write(source)
+
+        lines = source.count('\n')
+        gen, compile_time = compile_source(s_filename, c_filename, args)
+        if args.vm:
+            output, run_time = interpret(gen, args)
+        else:
+            build(c_filename, o_filename, args)
+            output, run_time = run(o_filename, args)
+
+        result = {
+            'lines': lines,
+            'lines_per_sec': int(lines / compile_time),
+            'run_ms': round(run_time * 1000, 1),
+            'output': output,
+        }
+        results[name] = result
+
+        old = baseline.get(name, {})
+
+        # higher throughput is better, show a slow down as a negative change
+        print "%-12s %7d %12.0f %8s %10.1f %8s  %s" % (name, lines,
+            result['lines_per_sec'], change(result['lines_per_sec'], old.get('lines_per_sec')),
+            result['run_ms'], change(result['run_ms'], old.get('run_ms')),
+            output.strip())
+
+        if old and old.get('output') != output:
+            print "  output changed, baseline was: %s" % old['output'].strip()
+
+    if args.save:
+        baseline.update(results)
+        baselines[config] = baseline
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=4, sort_keys=True, separators=(',', ': '))
+            f.write('\n')
+        print "saved %s" % args.baseline
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,268 @@
 #! /usr/bin/env python
 
+import os
 import sys
+import glob
+import shutil
 import argparse
+import tempfile
 import subprocess
+import cProfile
+import multiprocessing
+from StringIO import StringIO
 
 from src.scanner import Scanner
 from src.parser import Parser
 from src.gen import Gen
+from src.native import NativeGen
+from src.vm import VM, MEM_SIZE, MAX_STR_LEN
+from src.timing import PhaseTimer
+from src.cache import BuildCache
 
 argparser = argparse.ArgumentParser(description='EECS 6083 Compiler')
 
-argparser.add_argument('filename', help='input .src file')
+argparser.add_argument('filenames', nargs='+', metavar='filename', help='input .src files or directories of them')
 argparser.add_argument('-c', '--c_only', action='store_true', help='only generate .c file, do not compile it')
 argparser.add_argument('-r', '--run', action='store_true', help='run the program after compiling it')
+argparser.add_argument('--vm', action='store_true', help='run the program in the built in interpreter instead of compiling it with gcc')
+argparser.add_argument('-n', '--native', action='store_true', help='generate a C function for every procedure')
+argparser.add_argument('-O', dest='opt_level', type=int, choices=[0, 1, 2], default=1, help='optimization level for the front end and gcc (default: 1)')
+argparser.add_argument('--compact', action='store_true', help='leave the comments out of the C code, map it to the source with #line instead')
+argparser.add_argument('--check', action='store_true', help='stop with an error when the program runs out of stack')
+argparser.add_argument('--mem-size', type=int, metavar='WORDS', help='size of the memory for globals, stack and strings (default: 10000)')
+argparser.add_argument('--num-regs', type=int, metavar='N', help='number of registers available to -O0 code (default: 10000)')
+argparser.add_argument('--max-str-len', type=int, metavar='BYTES', help='maximum length of a string read by getString (default: 100)')
+argparser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(), help='number of files to build in parallel (default: %(default)s)')
+argparser.add_argument('-t', '--time-phases', action='store_true', help='report time, size and memory growth of every compiler phase')
+argparser.add_argument('-p', '--profile', metavar='FILE', help='profile the compiler and write pstats data to FILE')
+argparser.add_argument('--no-cache', action='store_true', help='always rebuild, do not use the build cache')
+argparser.add_argument('--cache-dir', default=os.path.expanduser('~/.cache/eece6083'), help='build cache directory (default: %(default)s)')
 args = argparser.parse_args()
 
-s_filename = args.filename
-c_filename = args.filename.rsplit(".", 1)[0] + '.c'
-o_filename = args.filename.rsplit(".", 1)[0]
+filenames = []
+for filename in args.filenames:
+    if os.path.isdir(filename):
+        filenames.extend(sorted(glob.glob(os.path.join(filename, '*.src'))))
+    else:
+        filenames.append(filename)
 
-gen = Gen()
-scanner = Scanner(s_filename)
-parser = Parser(scanner, gen)
+if not filenames:
+    argparser.error("no .src files found")
 
-if scanner.has_errors or parser.has_errors:
-    print "-"*50
-    print "BUILD FAILED"
-    sys.exit(1)
+if args.profile and len(filenames) > 1:
+    argparser.error("--profile only works on a single file")
+
+if args.vm and (args.native or args.c_only):
+    argparser.error("--vm does not generate C, it cannot be combined with -n or -c")
+
+cflags = ['-m32', '-O%d' % args.opt_level, '-Wno-int-to-pointer-cast', '-Wno-pointer-to-int-cast']
+
+# the runtime sizes are set when building the runtime and the program
+for name, value in [('MEM_SIZE', args.mem_size), ('NUM_REGS', args.num_regs), ('MAX_STR_LEN', args.max_str_len)]:
+    if value is not None:
+        cflags.append('-D%s=%d' % (name, value))
+
+cache = None if args.no_cache else BuildCache(args.cache_dir)
+
+def front_end(gen, s_filename, source, timer):
+    """
+    Parses and optimizes the text of the source file into gen. Returns
+    None if the build failed, else True if no warnings were printed.
+    """
+
+    scanner = Scanner(s_filename, source=source)
+
+    if args.time_phases:
+        tokens = timer.timed(scanner.token_iter(), 'scan', 'tokens')
+        scanner.token_iter = lambda: tokens
+
+    with timer.phase('parse', 'IR instrs') as phase:
+        parser = Parser(scanner, gen)
+        phase.count = len(gen.instrs)
+
+    if args.time_phases:
+        # the parser pulls tokens as it goes so scanning happens during
+        # parsing, do not count its time twice. Its memory is counted in
+        # the parse phase.
+        scan = timer.get('scan')
+        phase.wall -= scan.wall
+
+    if scanner.has_errors or parser.has_errors:
+        print "-"*50
+        print "BUILD FAILED"
+        return None
+
+    with timer.phase('optimize', 'IR instrs') as phase:
+        gen.optimize(args.opt_level)
+        phase.count = len(gen.instrs)
+
+    return not (scanner.has_warnings or parser.has_warnings)
+
+def generate(s_filename, source, c_filename, timer):
+    """
+    Compiles the source file to C. Returns None if the build failed, else
+    True if the result may be cached, i.e. no warnings were printed.
+    """
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if args.native:
+        gen = NativeGen(args.check, args.compact)
+    else:
+        gen = Gen(args.check, args.compact)
+
+    ok = front_end(gen, s_filename, source, timer)
+    if ok is None:
+        return None
+
+    with timer.phase('write', 'C lines') as phase:
+        gen.write_file(c_filename)
+
+    if args.time_phases:
+        with open(c_filename) as f:
+            phase.count = sum(1 for line in f)
+
+    if args.profile:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+    return ok
+
+def interpret(s_filename, source, timer):
+    """
+    Runs the program in the interpreter, returns the exit status
+    """
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    vm = VM(args.mem_size or MEM_SIZE, args.max_str_len or MAX_STR_LEN)
 
-gen.write_file(c_filename)
+    if front_end(vm, s_filename, source, timer) is None:
+        return 1
 
-if args.c_only:
-    sys.exit(0)
+    with timer.phase('assemble', 'blocks') as phase:
+        vm.assemble()
+        phase.count = len(vm.blocks)
+
+    if args.time_phases:
+        timer.report()
+
+    status = vm.run()
+    sys.stdout.flush()
+
+    if args.profile:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+    return status
+
+def build(s_filename):
+    """
+    Builds one program, returns the exit status
+    """
+
+    c_filename = s_filename.rsplit(".", 1)[0] + '.c'
+    o_filename = s_filename.rsplit(".", 1)[0]
+
+    timer = PhaseTimer()
+
+    try:
+        with open(s_filename) as f:
+            source = f.read()
+    except IOError:
+        print "%s: could not open file" % s_filename
+        return 1
+
+    if args.vm:
+        return interpret(s_filename, source, timer)
+
+    if cache:
+        # compact C code names the source file in its #line directives
+        key = cache.key(source, (args.native, args.check, args.compact, cflags, s_filename if args.compact else None))
+
+    if not cache or args.profile or not cache.fetch(key, 'out.c', c_filename):
+        ok = generate(s_filename, source, c_filename, timer)
+        if ok is None:
+            return 1
+        if ok and cache:
+            cache.store(key, 'out.c', c_filename)
+
+    if not args.c_only and (not cache or not cache.fetch(key, 'a.out', o_filename)):
+
+        with timer.phase('gcc', child=True):
+            gcc = subprocess.Popen(['gcc'] + cflags + ['-o', o_filename, '-I', 'runtime', runtime, c_filename], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            sys.stdout.write(gcc.communicate()[0])
+
+        if gcc.returncode != 0:
+            print "GCC ERROR"
+            # a negative status means gcc was killed by a signal
+            return gcc.returncode if gcc.returncode > 0 else 1
+
+        if cache:
+            cache.store(key, 'a.out', o_filename)
+
+    if args.time_phases:
+        timer.report()
+
+    return 0
+
+def build_captured(s_filename):
+    """
+    Builds one program in a worker process. Returns the exit status and
+    everything that was printed so the output of different files does not
+    get mixed up.
+    """
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        status = build(s_filename)
+        return status, sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+# the runtime is compiled once and linked into every program
+runtime = 'runtime/runtime.c'
+tmp_dir = None
+
+if not args.c_only and not args.vm:
+    if cache:
+        runtime = cache.runtime_object(cflags)
+    elif len(filenames) > 1:
+        tmp_dir = tempfile.mkdtemp()
+        runtime = os.path.join(tmp_dir, 'runtime.o')
+        if subprocess.call(['gcc'] + cflags + ['-I', 'runtime', '-c', '-o', runtime, 'runtime/runtime.c']) != 0:
+            print "GCC ERROR"
+            sys.exit(1)
+
+if len(filenames) == 1 or args.vm:
+    # programs run by the interpreter may read the terminal, one at a time
+    statuses = [build(filename) for filename in filenames]
+else:
+    pool = multiprocessing.Pool(args.jobs)
+    results = pool.map(build_captured, filenames, chunksize=1)
+    pool.close()
+    pool.join()
+
+    statuses = []
+    for filename, (status, output) in zip(filenames, results):
+        print "%s: %s" % (filename, "ok" if status == 0 else "FAILED")
+        if output:
+            print output.rstrip('\n')
+        statuses.append(status)
+
+    print "-"*50
+    print "%d built, %d failed" % (statuses.count(0), len(statuses) - statuses.count(0))
 
-return_code = subprocess.call(['gcc', '-m32', '-Wno-int-to-pointer-cast', '-Wno-pointer-to-int-cast', '-o', o_filename, '-I', 'runtime', 'runtime/runtime.c', c_filename])
+if tmp_dir:
+    shutil.rmtree(tmp_dir)
 
-if return_code == 1:
-    print "GCC ERROR"
-    sys.exit(return_code)
+if args.run and not args.c_only and not args.vm:
+    for filename, status in zip(filenames, statuses):
+        if status == 0:
+            subprocess.call([filename.rsplit(".", 1)[0]])
 
-if args.run:
-    subprocess.call([o_filename])
+sys.exit(max(statuses))
@@ -1,13 +1,17 @@
 #include <stdio.h>
+#include <setjmp.h>
+#include <signal.h>
+#include <unistd.h>
 #include "runtime.h"
 
 int R[NUM_REGS];
 int M[MEM_SIZE];
 int SP = 0;
 int FP = 0;
-int HP = MEM_SIZE - 1;
-float tmp_float;
+int HP = MEM_SIZE;
+float F[NUM_REGS];
 char tmp_string[MAX_STR_LEN];
+char *stack_base;
 
 void putInteger(int x)
 {
@@ -43,7 +47,207 @@ float getFloat()
     return x;
 }
 
-void getString()
+int getString()
 {
+    int x;
     fgets(tmp_string, MAX_STR_LEN, stdin);
+    x = allocString(strlen(tmp_string) / sizeof(int) + 1);
+    strcpy((char *)&M[x], tmp_string);
+    return x;
+}
+
+/*
+ * String heap
+ *
+ * Strings read at run time live at the top of M[] and the heap grows down
+ * towards the stack, HP is the lowest word in use. Every block is a header
+ * word holding the size of the block in words followed by the string.
+ * Strings are given whole size classes of 4 << c words. Blocks of dead
+ * strings are kept on one free list per size class, a block is on the
+ * list of the largest class it has room for.
+ *
+ * When the heap would run into the stack the dead strings are collected.
+ * Strings never point to other strings so marking is a single pass over
+ * everything that could hold the address of a string: the stack in M[],
+ * the registers R[] and the C stack (which holds the C locals of the
+ * generated code). Neighbouring dead blocks are merged and the dead blocks
+ * at the bottom of the heap are given back to the stack. A string that
+ * finds no block of its own class takes the front of a larger one.
+ */
+
+/* 28 classes cover every MAX_STR_LEN an int can hold */
+#define NUM_CLASSES 28
+#define MARKED 0x40000000
+
+#if MAX_STR_LEN / 4 + 1 > (4 << (NUM_CLASSES - 1))
+#error "MAX_STR_LEN is too large for the string size classes, increase NUM_CLASSES"
+#endif
+
+static int free_list[NUM_CLASSES];  /* 0 if empty, a string never starts at M[0] */
+static char is_string[MEM_SIZE];
+
+static int class_words(int c)
+{
+    return 4 << c;
+}
+
+static int size_class(int words)
+{
+    int c = 0;
+    while (class_words(c) < words)
+        c++;
+    return c;
+}
+
+/* puts the block with its header at M[h] on a free list */
+static void free_block(int h, int words)
+{
+    int c = 0;
+    while (c + 1 < NUM_CLASSES && class_words(c + 1) <= words)
+        c++;
+    M[h] = words;
+    M[h+1] = free_list[c];
+    free_list[c] = h + 1;
+}
+
+/* frees the dead blocks from the header at M[h] up to M[end] */
+static void release(int h, int end)
+{
+    if (h == HP)
+        HP = end;
+    else
+        free_block(h, end - h - 1);
+}
+
+static void mark(int x)
+{
+    if (x > HP && x < MEM_SIZE && is_string[x])
+        M[x-1] |= MARKED;
+}
+
+static void collect(void)
+{
+    jmp_buf regs;
+    int h, i, c, run, words;
+    int *p;
+
+    /* spill values that only live in machine registers onto the C stack */
+    setjmp(regs);
+
+    memset(is_string, 0, sizeof(is_string));
+    for (h = HP; h < MEM_SIZE; h += (M[h] & ~MARKED) + 1) {
+        M[h] &= ~MARKED;
+        is_string[h+1] = 1;
+    }
+
+    for (i = 0; i < SP; i++)
+        mark(M[i]);
+    for (i = 0; i < NUM_REGS; i++)
+        mark(R[i]);
+    for (p = (int *)&regs; p < (int *)stack_base; p++)
+        mark(*p);
+
+    for (c = 0; c < NUM_CLASSES; c++)
+        free_list[c] = 0;
+
+    /* run is the header of the first dead block after the last live one */
+    run = -1;
+    for (h = HP; h < MEM_SIZE; h += words + 1) {
+        words = M[h] & ~MARKED;
+        if (M[h] & MARKED) {
+            M[h] = words;
+            if (run >= 0)
+                release(run, h);
+            run = -1;
+        } else if (run < 0) {
+            run = h;
+        }
+    }
+    if (run >= 0)
+        release(run, MEM_SIZE);
+}
+
+/* takes a free block of at least class c, splitting off what is not needed */
+static int take_free(int c)
+{
+    int words = class_words(c);
+    int x, rest;
+
+    while (c < NUM_CLASSES && !free_list[c])
+        c++;
+    if (c == NUM_CLASSES)
+        return 0;
+
+    x = free_list[c];
+    free_list[c] = M[x];
+
+    rest = M[x-1] - words - 1;
+    if (rest >= class_words(0)) {
+        M[x-1] = words;
+        free_block(x + words, rest);
+    }
+    return x;
+}
+
+int allocString(int words)
+{
+    int c = size_class(words);
+    int x;
+
+    if (free_list[c]) {
+        x = free_list[c];
+        free_list[c] = M[x];
+        return x;
+    }
+
+    if (HP - class_words(c) - 1 < SP) {
+        collect();
+        x = take_free(c);
+        if (x)
+            return x;
+    }
+
+    if (HP - class_words(c) - 1 < SP) {
+        fprintf(stderr, "error: out of memory, the string heap ran into the stack\n");
+        exit(1);
+    }
+
+    HP -= class_words(c) + 1;
+    M[HP] = class_words(c);
+    return HP + 1;
+}
+
+/*
+ * Checks
+ */
+
+void stackOverflow(void)
+{
+    fprintf(stderr, "error: stack overflow, the stack ran into the string heap\n");
+    exit(1);
+}
+
+static void segfault(int sig)
+{
+    static const char message[] = "error: segmentation fault, most likely the C stack overflowed\n";
+    write(2, message, sizeof(message) - 1);
+    _exit(1);
+}
+
+void initChecks(void)
+{
+    /* the handler needs its own stack since the C stack may be full */
+    static char altstack[1 << 16];
+    stack_t ss;
+    struct sigaction sa;
+
+    ss.ss_sp = altstack;
+    ss.ss_size = sizeof(altstack);
+    ss.ss_flags = 0;
+    sigaltstack(&ss, NULL);
+
+    memset(&sa, 0, sizeof(sa));
+    sa.sa_handler = segfault;
+    sa.sa_flags = SA_ONSTACK;
+    sigaction(SIGSEGV, &sa, NULL);
 }
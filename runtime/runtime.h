@@ -4,18 +4,46 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <math.h>
 
+/* the sizes can be changed with -D when building (see compiler.py) */
+#ifndef NUM_REGS
 #define NUM_REGS  10000
+#endif
+#ifndef MEM_SIZE
 #define MEM_SIZE  10000
+#endif
+#ifndef MAX_STR_LEN
 #define MAX_STR_LEN 100
+#endif
 
 extern int R[NUM_REGS];
 extern int M[MEM_SIZE];
 extern int SP;
 extern int FP;
 extern int HP;
-extern float tmp_float;
+extern float F[NUM_REGS];
 extern char tmp_string[MAX_STR_LEN];
+extern char *stack_base;
+
+/* has to be run at the start of main, strings referenced from C locals
+   above this point are not seen by the string heap */
+#define INIT_HEAP() (stack_base = (char *)__builtin_frame_address(0))
+
+/* floats are stored in the int words of M[] as their raw bits */
+static inline int floatToBits(float x)
+{
+    int i;
+    memcpy(&i, &x, sizeof(float));
+    return i;
+}
+
+static inline float bitsToFloat(int i)
+{
+    float x;
+    memcpy(&x, &i, sizeof(float));
+    return x;
+}
 
 void putInteger(int);
 void putBool(int);
@@ -25,6 +53,14 @@ void putFloat(float x);
 int getInteger();
 int getBool();
 float getFloat();
-void getString();
+int getString();
+
+int allocString(int words);
+
+/* checks emitted by the compiler in --check mode */
+#define CHECK_STACK(n) if (SP + (n) > HP) stackOverflow()
+
+void initChecks(void);
+void stackOverflow(void);
 
 #endif
@@ -22,8 +22,7 @@ putstring:
     goto *(void *)R[0];
 
 putfloat:
-    memcpy(&tmp_float, &M[FP], sizeof(float));
-    putFloat(tmp_float);
+    putFloat(bitsToFloat(M[FP]));
     R[0] = M[FP-2];
     FP = M[FP-1];
     SP = SP - 3;
@@ -39,19 +38,14 @@ getbool:
     goto *(void *)R[0];
 
 getfloat:
-    tmp_float = getFloat();
-    memcpy(&R[0], &tmp_float, sizeof(float));
-    M[M[FP]] = R[0];
+    M[M[FP]] = floatToBits(getFloat());
     R[0] = M[FP-2];
     FP = M[FP-1];
     SP = SP - 3;
     goto *(void *)R[0];
 
 getstring:
-    getString();
-    memcpy(&M[HP], tmp_string, MAX_STR_LEN);
-    M[M[FP]] = HP;
-    HP -= 100;
+    M[M[FP]] = getString();
     R[0] = M[FP-2];
     FP = M[FP-1];
     SP = SP - 3;
@@ -0,0 +1,39 @@
+static void p_putinteger(int x)
+{
+    putInteger(x);
+}
+
+static void p_putbool(int x)
+{
+    putBool(x);
+}
+
+static void p_putstring(int x)
+{
+    putString(x);
+}
+
+static void p_putfloat(int x)
+{
+    putFloat(bitsToFloat(x));
+}
+
+static void p_getinteger(int *x)
+{
+    *x = getInteger();
+}
+
+static void p_getbool(int *x)
+{
+    *x = getInteger();
+}
+
+static void p_getfloat(int *x)
+{
+    *x = floatToBits(getFloat());
+}
+
+static void p_getstring(int *x)
+{
+    *x = getString();
+}
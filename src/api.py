@@ -0,0 +1,82 @@
+"""
+Compiling in process without touching the terminal or the file system, for
+tools that keep the compiler loaded and call it many times.
+
+    result = compile(source_text, Options(opt_level=2))
+    if result.ok:
+        c_code = result.code
+    for diagnostic in result.diagnostics:
+        print diagnostic
+"""
+
+from cStringIO import StringIO
+
+from scanner import Scanner
+from parser import Parser, ScanError
+from gen import Gen
+from native import NativeGen
+
+class Options:
+
+    def __init__(self, opt_level=1, native=False, checks=False, compact=False, filename='<source>'):
+        self.opt_level = opt_level
+        self.native = native
+        self.checks = checks
+        self.compact = compact      # no comments in the C code, only #line
+        self.filename = filename    # only used in diagnostics
+
+
+class Result:
+
+    def __init__(self, diagnostics, code=None):
+        self.diagnostics = diagnostics
+        self.code = code            # C program or None if the build failed
+
+    @property
+    def ok(self):
+        return self.code is not None
+
+    @property
+    def errors(self):
+        return [d for d in self.diagnostics if d.severity == 'error']
+
+    @property
+    def warnings(self):
+        return [d for d in self.diagnostics if d.severity == 'warning']
+
+
+def compile(source, options=None):
+    """
+    Compiles the program text 'source' to C. Returns a Result holding the
+    diagnostics in the order they were found and the generated code.
+    """
+
+    if options is None:
+        options = Options()
+
+    if options.native:
+        gen = NativeGen(options.checks, options.compact)
+    else:
+        gen = Gen(options.checks, options.compact)
+    scanner = Scanner(options.filename, source=source, quiet=True)
+    try:
+        parser = Parser(scanner, gen)
+    except ScanError:
+        # the parser can not always recover from an invalid token, the
+        # scanner has reported it
+        return Result(scanner.diagnostics)
+    except StopIteration:
+        # the input ended while the parser was skipping to where it could
+        # go on
+        scanner.error("unexpected end of file")
+        return Result(scanner.diagnostics)
+
+    if scanner.has_errors or parser.has_errors:
+        return Result(scanner.diagnostics)
+
+    gen.optimize(options.opt_level)
+
+    f = StringIO()
+    gen.write(f)
+
+    return Result(scanner.diagnostics, f.getvalue())
@@ -0,0 +1,104 @@
+import os
+import glob
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+from gen import RUNTIME_DIR
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the driver decides how the options map onto the code generator and gcc
+DRIVER = os.path.join(os.path.dirname(SRC_DIR), 'compiler.py')
+
+_version = None
+
+def compiler_version():
+    """
+    Returns a hash of the compiler, its driver and the runtime sources. Any
+    change to them invalidates everything built before.
+    """
+    global _version
+    if _version is None:
+        h = hashlib.sha1()
+        files = glob.glob(os.path.join(SRC_DIR, '*.py')) + glob.glob(os.path.join(RUNTIME_DIR, '*')) + [DRIVER]
+        for filename in sorted(files):
+            h.update(os.path.basename(filename))
+            with open(filename, 'rb') as f:
+                h.update(f.read())
+        _version = h.hexdigest()
+    return _version
+
+
+class BuildCache:
+    """
+    Content addressed store of build outputs. Entries are keyed by a hash of
+    the source text, the compiler version and the flags used, so a hit can
+    be copied out instead of being built again.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, source, flags):
+        h = hashlib.sha1()
+        h.update(compiler_version())
+        h.update(repr(flags))
+        h.update(source)
+        return h.hexdigest()
+
+    def path(self, key, name):
+        return os.path.join(self.directory, key[:2], key[2:], name)
+
+    def fetch(self, key, name, filename):
+        """
+        Copies the cached output 'name' to filename. Returns False if it is
+        not in the cache.
+        """
+        path = self.path(key, name)
+        if not os.path.exists(path):
+            return False
+        shutil.copy(path, filename)
+        return True
+
+    def store(self, key, name, filename):
+        self.put(self.path(key, name), lambda tmp: shutil.copy(filename, tmp))
+
+    def put(self, path, write):
+        """
+        Creates path by calling write() on a temporary file next to it and
+        renaming it into place, other builds never see a partial file
+        """
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # somebody else created it first
+                pass
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        os.close(fd)
+        try:
+            write(tmp)
+            os.rename(tmp, path)
+        except:
+            os.remove(tmp)
+            raise
+
+    def runtime_object(self, cflags):
+        """
+        Returns the path of runtime.c compiled with cflags, compiling it
+        only if it is not already in the cache
+        """
+        key = self.key('runtime', cflags)
+        path = self.path(key, 'runtime.o')
+
+        if not os.path.exists(path):
+            def compile_runtime(tmp):
+                return_code = subprocess.call(['gcc'] + cflags + ['-I', RUNTIME_DIR, '-c', '-o', tmp, os.path.join(RUNTIME_DIR, 'runtime.c')])
+                if return_code != 0:
+                    raise OSError("could not compile the runtime")
+            self.put(path, compile_runtime)
+
+        return path
@@ -0,0 +1,46 @@
+from color import Color
+
+class Diagnostic:
+    """
+    An error or warning about a location in the source. The mark underlines
+    the offending text of line_text starting at mark_start, both counted
+    from the first non whitespace character of the line.
+    """
+
+    COLORS = {
+        'error': Color.RED,
+        'warning': Color.YELLOW,
+    }
+
+    def __init__(self, severity, message, filename, line_num, col_num, line_text, mark_start, mark_length=1):
+        self.severity = severity
+        self.message = message
+        self.filename = filename
+        self.line_num = line_num
+        self.col_num = col_num
+        self.line_text = line_text
+        self.mark_start = mark_start
+        self.mark_length = mark_length
+
+    def format(self, color=True):
+        """
+        Returns the message the way it is printed on the terminal
+        """
+
+        if color:
+            bold, white, default, green = Color.BOLD, Color.WHITE, Color.DEFAULT, Color.GREEN
+            label = self.COLORS.get(self.severity, Color.WHITE)
+        else:
+            bold = white = default = green = label = ''
+
+        return "\n".join([
+            bold + white + "%s:%s:%s: " % (self.filename, self.line_num, self.col_num) + label + "%s: " % self.severity + white + self.message,
+            default + self.line_text.strip(),
+            green + "%s^%s" % (' '*(self.mark_start-1), '~'*(self.mark_length-1)) + default,
+        ])
+
+    def __str__(self):
+        return self.format(color=False)
+
+    def __repr__(self):
+        return "<%s %s:%s:%s %r>" % (self.severity, self.filename, self.line_num, self.col_num, self.message)
@@ -0,0 +1,155 @@
+from ir import *
+
+class BasicBlock:
+
+    def __init__(self, index):
+        self.index = index
+        self.instrs = []
+        self.succs = []
+        self.preds = []
+        self.uses = set()       # registers read before being written in this block
+        self.defs = set()       # registers written in this block
+        self.live_in = set()
+        self.live_out = set()
+
+    def __repr__(self):
+        return "<block %d, succs=%r>" % (self.index, [b.index for b in self.succs])
+
+
+def build_blocks(instrs):
+    """
+    Splits a list of instructions into basic blocks and links them into a
+    control flow graph.
+
+    Every instruction is expected to provide:
+        label         - name of the label it defines (or None)
+        targets       - list of labels it may jump to
+        falls_through - False if control never reaches the next instruction
+        indirect      - True if it jumps to a computed address
+        address_of    - list of labels whose address it takes
+
+    Calls and returns are linked precisely: a Return goes back to the
+    return labels of the calls to its own procedure (the one of the last
+    Enter), a call into the runtime comes back at its own return label.
+    """
+
+    blocks = []
+    block = None
+
+    for instr in instrs:
+
+        # a label always starts a new block
+        if block is None or (instr.label and block.instrs):
+            block = BasicBlock(len(blocks))
+            blocks.append(block)
+
+        block.instrs.append(instr)
+
+        # a jump always ends the current block
+        if instr.targets or instr.indirect or not instr.falls_through:
+            block = None
+
+    labels = {}
+    address_taken = []
+
+    for b in blocks:
+        for instr in b.instrs:
+            if instr.label:
+                labels[instr.label] = b
+            address_taken.extend(instr.address_of)
+
+    # computed gotos can only go to labels that had their address taken, the
+    # same is true for any jump out of the generated code (e.g. into the runtime)
+    indirect_succs = [labels[l] for l in address_taken if l in labels]
+
+    # procedure symbol -> blocks following the calls to it
+    returns = {}
+    for b in blocks:
+        for instr in b.instrs:
+            if isinstance(instr, Call) and instr.return_label in labels:
+                returns.setdefault(instr.symbol, []).append(labels[instr.return_label])
+
+    procedure = None
+
+    for i, b in enumerate(blocks):
+
+        for instr in b.instrs:
+            if isinstance(instr, Enter):
+                procedure = instr.procedure
+
+        last = b.instrs[-1]
+        succs = []
+
+        for target in last.targets:
+            if target in labels:
+                succs.append(labels[target])
+            elif isinstance(last, Call) and last.return_label in labels:
+                succs.append(labels[last.return_label])
+            else:
+                succs.extend(indirect_succs)
+
+        if isinstance(last, Return):
+            succs.extend(returns.get(procedure, []))
+        elif last.indirect:
+            succs.extend(indirect_succs)
+
+        if last.falls_through and i + 1 < len(blocks):
+            succs.append(blocks[i+1])
+
+        seen = set()
+        for s in succs:
+            if s.index not in seen:
+                seen.add(s.index)
+                b.succs.append(s)
+                s.preds.append(b)
+
+    return blocks
+
+
+def reachable(blocks, roots):
+    """
+    Returns the set of indices of the blocks that can be reached from the
+    blocks starting with one of the labels in roots
+    """
+
+    work = [b for b in blocks if any(x.label in roots for x in b.instrs)]
+    seen = set(b.index for b in work)
+
+    while work:
+        for s in work.pop().succs:
+            if s.index not in seen:
+                seen.add(s.index)
+                work.append(s)
+
+    return seen
+
+
+def liveness(blocks):
+    """
+    Classic backwards data flow analysis. Fills in live_in and live_out for
+    every block. Instructions must provide 'defs' and 'uses' sets.
+    """
+
+    for b in blocks:
+        b.uses = set()
+        b.defs = set()
+        for instr in b.instrs:
+            b.uses |= (instr.uses - b.defs)
+            b.defs |= instr.defs
+        b.live_in = set()
+        b.live_out = set()
+
+    changed = True
+    while changed:
+        changed = False
+        for b in reversed(blocks):
+            live_out = set()
+            for s in b.succs:
+                live_out |= s.live_in
+            live_in = b.uses | (live_out - b.defs)
+            if live_out != b.live_out or live_in != b.live_in:
+                b.live_out = live_out
+                b.live_in = live_in
+                changed = True
+
+    return blocks
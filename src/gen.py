@@ -1,78 +1,109 @@
+import os
+
+from ir import *
+from optimize import optimize
+from regalloc import RegisterAllocator
+
+RUNTIME_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'runtime')
+
+# size of the write buffer of generated files
+BUFFER_SIZE = 1 << 16
+
+# the relation that is true when the key is not
+NEGATED = {'<': '>=', '>=': '<', '>': '<=', '<=': '>', '==': '!=', '!=': '=='}
+
+_runtime_sources = {}
+
+def float_literal(value):
+    """
+    Returns the C literal of a float, literals too large for a float are
+    infinite
+    """
+    if value != value:
+        return "NAN"
+    if value in (float('inf'), float('-inf')):
+        return "INFINITY" if value > 0 else "-INFINITY"
+    return "%rf" % value
+
+def runtime_source(name):
+    """
+    Returns the text of a runtime file that is pasted into the generated
+    code. Every file is only read once per process.
+    """
+    if name not in _runtime_sources:
+        with open(os.path.join(RUNTIME_DIR, name)) as f:
+            _runtime_sources[name] = f.read()
+    return _runtime_sources[name]
+
 class Gen:
 
-    def __init__(self):
+    def __init__(self, checks=False, compact=False):
 
-        self.lines = []
-        self.registers = []
-        self.memory = []
+        self.checks = checks    # guard against the stack overflowing at run time
+        self.compact = compact  # no comments, only #line directives
+        self.line_file = None   # file named by the last #line
+        self.instrs = []
         self.current_reg = 1
-        self.current_mem = 0
         self.label_counts = {}
-
-    def write(self, string, indent='    '):
-        self.lines.append(indent+string)
-
-    def write_file(self, filename):
-        with open(filename, 'w') as f:
-            f.write('#include <runtime.h>\n')
-            f.write('int main(void) {\n')
-            f.write('    goto main;\n\n')
-            f.write(open("runtime/runtime_inline.c").read())
-            f.write('\n')
-            f.writelines('\n'.join(self.lines))
-            f.write('\n\n')
-            f.write("return 0;\n")
-            f.write("}\n")
-
-    def new_reg(self):
+        self.reg_names = {}
+        self.reg_decl = ""
+        self.strings = {}
+        self.string_pool = ""
+        self.string_base = 0
+        self.string_size = 0
+        self.bases = {}         # array symbol -> C pointer to its first element
+        self.pointers = {}      # (array symbol, counter register) -> C pointer to the element
+        self.loops = []         # what to restore at the end of each open counted loop
+        self.pointer_count = 0
+
+    """
+    Building the IR
+    """
+
+    def emit(self, instr):
+        self.instrs.append(instr)
+
+    def new_reg(self, type=None):
         i = self.current_reg
         self.current_reg += 1
-        return i
+        return Reg(i, type)
 
-    def set_new_reg(self, string):
+    def move(self, src, type=None):
+        reg = self.new_reg(type or src.type)
+        self.emit(Move(reg, src))
+        return reg
 
-        i = self.current_reg
-        self.write("R[%d] = %s;" % (i, string))
-        self.current_reg += 1
-        return i
+    def unop(self, op, src):
+        reg = self.new_reg(src.type)
+        self.emit(UnOp(reg, op, src))
+        return reg
 
-    def move_mem_to_reg(self, mem, reg, offset_reg=None):
-        if offset_reg:
-            mem = self.set_new_reg("%s+R[%s];" % (mem, offset_reg))
-            self.write("R[%s] = M[FP+R[%s]];" % (reg, mem))
-        else:
-            self.write("R[%s] = M[FP+%s];" % (reg, mem))
+    def binop(self, op, lhs, rhs, type=None):
+        reg = self.new_reg(type or lhs.type)
+        self.emit(BinOp(reg, op, lhs, rhs))
+        return reg
 
-    def move_reg_to_mem_global(self, reg, mem, offset_reg=None):
-        if offset_reg:
-            mem = self.set_new_reg("%s+R[%s];" % (mem, offset_reg))
-            self.move_reg_to_mem_indirect(reg, mem)
-        else:
-            self.write("M[%s] = R[%s];" % (mem, reg))
+    def load(self, symbol, index=None):
+        reg = self.new_reg(symbol.type)
+        self.emit(Load(reg, symbol, index))
+        return reg
 
-    def move_reg_to_mem(self, reg, mem, offset_reg=None):
-        if offset_reg:
-            mem = self.set_new_reg("%s+R[%s]" % (mem, offset_reg))
-            self.write("M[FP+R[%s]] = R[%s];" % (mem, reg))
-        else:
-            self.write("M[FP+%s] = R[%s];" % (mem, reg))
+    def store(self, symbol, index, src):
+        self.emit(Store(symbol, index, src))
 
-    def move_reg_to_mem_indirect(self, reg, mem):
-        self.write("M[R[%s]] = R[%s];" % (mem, reg))
+    def string(self, value):
+        reg = self.new_reg('STRING')
+        self.emit(String(reg, value))
+        return reg
 
     def comment(self, string):
-        self.write("/* %s */" % string)
-        #self.write('printf("%s\\n");' % string)
-
-    def add_mem(self, string):
+        self.emit(Comment(string))
 
-        i = self.current_mem
-        self.lines.append("M[%d] = %s;" % (i, string))
-        self.current_mem += 1
-        return i
+    def source_line(self, filename, line_num, text=None):
+        self.emit(SourceLine(filename, line_num, text))
 
     def put_label(self, name):
-        self.write("%s:" % name, indent='')
+        self.emit(Label(name))
 
     def new_label(self, prefix='label'):
         if prefix not in self.label_counts:
@@ -82,49 +113,412 @@ class Gen:
         return "%s_%d" % (prefix, i)
 
     def goto_label(self, label):
-        self.write("goto %s;" % label)
-
-    def push_stack(self, register):
-        self.write("M[SP] = R[%s];" % register)
-        self.write("SP++;")
-
-    def pop_stack(self):
-        reg = self.set_new_reg("M[SP]")
-        self.write("SP--;")
-        return reg
-
-    def dec_sp(self, amount=1):
-        self.write("SP = SP - %d;" % amount)
-
-    def inc_sp(self, amount=1):
-        self.write("SP = SP + %d;" % amount)
-
-    def set_fp(self, addr):
-        self.write("FP = %s;" % addr)
-
-    def set_sp_to_fp(self):
-        self.write("SP = FP;")
-
-    def set_fp_to_sp(self):
-        self.write("FP = SP;")
-
-    def return_to_caller(self, param_size, local_size):
-        self.comment("returning")
-
-        self.comment("getting return address")
-        return_reg = self.set_new_reg("M[FP-2];")
-
-        self.comment("restore previous fp")
-        self.set_fp("M[FP-1];")
-
-        self.comment("moving sp back below local vars")
-        self.write("SP = SP - %s;" % local_size)
-
-        self.comment("cleaning up argument stack")
-        self.write("SP = SP - %s;" % param_size)
-
-        self.comment("cleaning up return addr and old FP")
-        self.write("SP = SP - 2;")
-
-        self.write("goto *(void *)R[%s];" % return_reg)
+        self.emit(Jump(label))
+
+    def branch_false(self, cond, label):
+        self.emit(BranchFalse(cond, label))
+
+    def call(self, symbol, args):
+        # generate a label that we will return to after call is complete
+        return_label = self.new_label("return_from_%s" % symbol.name)
+        self.emit(Call(symbol, args, return_label))
+        self.emit(Label(return_label))
+
+    def enter(self, frame, procedure=None, globals=None):
+        self.emit(Enter(frame, procedure, globals))
+
+    def return_to_caller(self, frame):
+        self.emit(Return(frame))
+
+    """
+    Lowering the IR to C
+    """
+
+    def optimize(self, level=1):
+        """
+        Runs the optimization passes of the given level over the IR. From
+        level 1 on registers are also allocated to C locals.
+        """
+        self.instrs = optimize(self.instrs, level)
+        if level >= 1:
+            self.allocate_registers()
+
+    def allocate_registers(self):
+        """
+        Maps the virtual registers onto a minimal set of C locals
+        """
+        allocator = RegisterAllocator(self.instrs)
+        colors = allocator.allocate()
+        self.reg_names = dict((reg, allocator.name(reg)) for reg in colors)
+        self.reg_decl = allocator.declaration()
+
+    def layout_strings(self):
+        """
+        Places every distinct string literal once in a pool of words right
+        above the global variables. The pool is copied into M[] when the
+        program starts and literals are referred to by their address in it.
+        """
+
+        for instr in self.instrs:
+            if isinstance(instr, Enter) and instr.globals:
+                self.string_base = instr.globals.local_size
+
+        self.strings = {}
+        pool = []
+        size = 0
+
+        for instr in self.instrs:
+            if isinstance(instr, String) and instr.value not in self.strings:
+                self.strings[instr.value] = self.string_base + size
+                # zero terminated and padded to a whole number of words
+                words = len(instr.value) // 4 + 1
+                pool.append(instr.value + '\0' * (words * 4 - len(instr.value)))
+                size += words
+
+        self.string_pool = pool
+        self.string_size = size
+
+    def limits(self):
+        """
+        Generates preprocessor checks that the runtime was built with
+        enough registers and memory for this program
+        """
+
+        regs = set()
+        for instr in self.instrs:
+            regs |= instr.defs | instr.uses
+        regs = [r for r in regs if r not in self.reg_names]
+
+        if regs:
+            yield "#if NUM_REGS <= %d" % max(regs)
+            yield '#error "the program needs more registers, increase NUM_REGS"'
+            yield "#endif"
+
+        yield "#if MEM_SIZE <= %d" % (self.string_base + self.string_size)
+        yield '#error "the global variables do not fit into memory, increase MEM_SIZE"'
+        yield "#endif"
+
+    def pool_declaration(self):
+        """
+        Generates the C definition of the string pool, one literal per line
+        """
+        if not self.string_pool:
+            return
+        yield "static const char string_pool[] ="
+        for value in self.string_pool:
+            yield '    "%s"' % "".join(c if c.isalnum() or c in " _,;:.'" else "\\%03o" % ord(c) for c in value)
+        yield "    ;"
+
+    def load_string_pool(self):
+        if self.string_size:
+            yield "    /* copying string literals above the global vars */"
+            yield "    memcpy(&M[%d], string_pool, %d);" % (self.string_base, self.string_size * 4)
 
+    def write_file(self, filename):
+        with open(filename, 'w', BUFFER_SIZE) as f:
+            self.write(f)
+
+    def write(self, f):
+        """
+        Writes the C program to the file like object f. Lines are written
+        as they are generated, the whole program is never held in memory.
+        """
+        self.layout_strings()
+        f.write('#include <runtime.h>\n')
+        f.writelines(line + '\n' for line in self.limits())
+        f.writelines(line + '\n' for line in self.pool_declaration())
+        f.write('int main(void) {\n')
+        if self.reg_decl:
+            f.write('    %s\n' % self.reg_decl)
+        f.write('    goto main;\n\n')
+        f.write(runtime_source('runtime_inline.c'))
+        f.write('\n')
+        f.writelines(line + '\n' for line in self.lower())
+        f.write('\n')
+        f.write("return 0;\n")
+        f.write("}\n")
+
+    def lower(self):
+        """
+        Generates the lines of C code for every instruction
+        """
+        for instr in self.instrs:
+            for line in self.lower_instr(instr):
+                yield line
+
+    def lower_instr(self, instr):
+        """
+        Generates the lines of C code for one instruction
+        """
+        lower = getattr(self, 'lower_' + instr.__class__.__name__.lower())
+        for line in lower(instr):
+            if self.compact and line.lstrip().startswith('/*'):
+                continue
+            yield line
+
+    def operand(self, x):
+        """
+        Returns the C expression for an operand
+        """
+        if isinstance(x, Reg):
+            if x.n in self.reg_names:
+                return self.reg_names[x.n]
+            return "%s[%d]" % ('F' if x.type == 'FLOAT' else 'R', x.n)
+        if isinstance(x, Addr):
+            return self.address(x.symbol)
+        if x.type == 'FLOAT':
+            return float_literal(x.value)
+        return str(x.value)
+
+    def bits(self, x):
+        """
+        Returns the C expression for an operand as it is stored in memory,
+        floats are kept in the int words of M[] as their raw bits
+        """
+        if is_float(x):
+            return "floatToBits(%s)" % self.operand(x)
+        return self.operand(x)
+
+    def from_bits(self, dst, value):
+        """
+        Returns the C expression converting a word of memory into a value
+        for the register dst
+        """
+        if is_float(dst):
+            return "bitsToFloat(%s)" % value
+        return value
+
+    def address(self, symbol, index=None):
+        """
+        Returns the C expression for the address of a variable
+        """
+        if symbol.isglobal:
+            addr = "%d" % symbol.addr
+        elif symbol.indirect:
+            addr = "M[FP+%d]" % symbol.addr
+        else:
+            addr = "FP+%d" % symbol.addr
+
+        if index is not None:
+            addr += "+%s" % self.operand(index)
+
+        return addr
+
+    def variable(self, symbol, index=None):
+        """
+        Returns the C lvalue of a variable, inside of counted loops arrays
+        may be accessed through pointers set up in front of the loop
+        """
+        if isinstance(index, Reg) and (symbol, index.n) in self.pointers:
+            return "*%s" % self.pointers[symbol, index.n]
+        if symbol in self.bases:
+            return "%s[%s]" % (self.bases[symbol], self.operand(index))
+        return self.storage(symbol, index)
+
+    def storage(self, symbol, index=None):
+        """
+        Returns the C lvalue of the memory a variable is kept in
+        """
+        return "M[%s]" % self.address(symbol, index)
+
+    def base_pointers(self, loop):
+        """
+        Returns (symbol, address) for the arrays of a counted loop that are
+        worth addressing through a pointer set up before the loop, i.e.
+        the ones whose address depends on FP
+        """
+        symbols = []
+        for access in loop.arrays:
+            symbol = access.symbol
+            if symbol.isglobal or symbol in self.bases or symbol in symbols:
+                continue
+            # already walked by a pointer of an enclosing loop
+            if isinstance(access.index, Reg) and (symbol, access.index.n) in self.pointers:
+                continue
+            symbols.append(symbol)
+        return [(s, "&M[%s]" % self.address(s)) for s in symbols]
+
+    def walked_arrays(self, loop):
+        """
+        Returns the arrays indexed by the counter of a counted loop that are
+        walked with a pointer incremented along with it. gcc does better
+        with plain indexing for the arrays at fixed addresses.
+        """
+        return [s for s in loop.strided if not s.isglobal]
+
+    def new_pointer(self, symbol, kind):
+        self.pointer_count += 1
+        return "%s_%s%d" % (symbol.name, kind, self.pointer_count)
+
+    def lower_comment(self, instr):
+        yield "    /* %s */" % instr.text
+
+    def lower_sourceline(self, instr):
+        if self.compact and instr.filename == self.line_file:
+            yield '#line %d' % instr.line_num
+        elif self.compact:
+            self.line_file = instr.filename
+            yield '#line %d "%s"' % (instr.line_num, instr.filename.replace('\\', '\\\\').replace('"', '\\"'))
+        else:
+            yield "    /* statement: %s */" % instr.text
+
+    def lower_move(self, instr):
+        yield "    %s = %s;" % (self.operand(instr.dst), self.operand(instr.src))
+
+    def lower_unop(self, instr):
+        yield "    %s = %s%s;" % (self.operand(instr.dst), instr.op, self.operand(instr.src))
+
+    def lower_binop(self, instr):
+        yield "    %s = %s %s %s;" % (self.operand(instr.dst), self.operand(instr.lhs), instr.op, self.operand(instr.rhs))
+
+    def lower_load(self, instr):
+        value = self.variable(instr.symbol, instr.index)
+        yield "    %s = %s;" % (self.operand(instr.dst), self.from_bits(instr.dst, value))
+
+    def lower_store(self, instr):
+        yield "    %s = %s;" % (self.variable(instr.symbol, instr.index), self.bits(instr.src))
+
+    def lower_string(self, instr):
+        yield "    %s = %d;" % (self.operand(instr.dst), self.strings[instr.value])
+
+    def lower_label(self, instr):
+        yield "%s:" % instr.label
+
+    def lower_jump(self, instr):
+        yield "    goto %s;" % instr.targets[0]
+
+    def lower_branchfalse(self, instr):
+        yield "    if(%s == 0) { goto %s; }" % (self.operand(instr.cond), instr.targets[0])
+
+    def lower_countedloop(self, instr):
+
+        # the address computations are done once in front of the loop,
+        # arrays indexed by the counter are walked with a pointer
+        bases = {}
+        pointers = {}
+        decls = []
+
+        for symbol, addr in self.base_pointers(instr):
+            bases[symbol] = self.new_pointer(symbol, 'base')
+            decls.append("    int *%s = %s;" % (bases[symbol], addr))
+
+        for symbol in self.walked_arrays(instr):
+            name = self.new_pointer(symbol, 'ptr')
+            decls.append("    int *%s = &%s;" % (name, self.variable(symbol, instr.start)))
+            pointers[symbol, instr.dst.n] = name
+
+        self.loops.append((dict(self.bases), dict(self.pointers), decls, sorted(pointers.values())))
+        self.bases.update(bases)
+        self.pointers.update(pointers)
+
+        if decls:
+            yield "    {"
+            for decl in decls:
+                yield decl
+
+        i = self.operand(instr.dst)
+        yield "    for (%s = %s; %s %s %s;) {" % (i, self.operand(instr.start), i, instr.op, self.operand(instr.limit))
+
+    def lower_endloop(self, instr):
+
+        self.bases, self.pointers, decls, walked = self.loops.pop()
+
+        yield "    %s++;" % self.operand(instr.counter)
+        for name in walked:
+            yield "    %s++;" % name
+        yield "    }"
+
+        if decls:
+            yield "    }"
+
+    def lower_copyarray(self, instr):
+        i = self.operand(instr.dst)
+        end = self.operand(instr.limit)
+        if instr.op == '<=' and isinstance(instr.limit, Const):
+            end = str(instr.limit.value + 1)
+        elif instr.op == '<=':
+            end += " + 1"
+        if self.operand(instr.start) != i:
+            yield "    %s = %s;" % (i, self.operand(instr.start))
+        yield "    if (%s < %s) {" % (i, end)
+        # array parameters may both point to the same array of the caller
+        yield "        memmove(&%s, &%s, (%s - %s) * sizeof(int));" % (self.variable(instr.dst_symbol, instr.dst), self.variable(instr.src_symbol, instr.dst), end, i)
+        yield "        %s = %s;" % (i, end)
+        yield "    }"
+
+    def lower_comparebranch(self, instr):
+        lhs, rhs = self.operand(instr.lhs), self.operand(instr.rhs)
+        if instr.when:
+            cond = "%s %s %s" % (lhs, instr.op, rhs)
+        elif is_float(instr.lhs):
+            # the negated relation would be true for NaN
+            cond = "!(%s %s %s)" % (lhs, instr.op, rhs)
+        else:
+            cond = "%s %s %s" % (lhs, NEGATED[instr.op], rhs)
+        yield "    if(%s) { goto %s; }" % (cond, instr.targets[0])
+
+    def lower_call(self, instr):
+        yield "    /* calling %s */" % instr.symbol.name
+
+        if self.checks:
+            yield "    CHECK_STACK(%d);" % (len(instr.args) + 2)
+
+        yield "    /* pushing return address onto stack */"
+        yield "    M[SP] = (int)&&%s;" % instr.return_label
+        yield "    SP++;"
+
+        yield "    /* pushing current FP onto stack */"
+        yield "    M[SP] = FP;"
+        yield "    SP++;"
+
+        # arguments are evaluated relative to the callers frame so the new
+        # frame pointer is only set once they are all on the stack
+        yield "    /* pushing args onto stack */"
+        for arg in instr.args:
+            yield "    M[SP] = %s;" % self.bits(arg)
+            yield "    SP++;"
+
+        # new frame for this call
+        yield "    FP = SP - %d;" % len(instr.args)
+
+        yield "    goto %s;" % instr.symbol.label
+
+    def lower_enter(self, instr):
+        if instr.globals:
+            yield "    INIT_HEAP();"
+            if self.checks:
+                yield "    initChecks();"
+            for line in self.load_string_pool():
+                yield line
+            yield "    /* starting fp at top of string literals */"
+            yield "    FP = %d;" % (self.string_base + self.string_size)
+            yield "    /* resetting sp to fp */"
+            yield "    SP = FP;"
+
+        if instr.frame.local_size > 0:
+            if self.checks:
+                yield "    CHECK_STACK(%d);" % instr.frame.local_size
+            yield "    /* moving sp to top of local vars */"
+            yield "    SP = SP + %d;" % instr.frame.local_size
+
+    def lower_return(self, instr):
+        yield "    /* returning */"
+
+        yield "    /* getting return address */"
+        yield "    R[0] = M[FP-2];"
+
+        yield "    /* restore previous fp */"
+        yield "    FP = M[FP-1];"
+
+        if instr.frame.local_size > 0:
+            yield "    /* moving sp back below local vars */"
+            yield "    SP = SP - %d;" % instr.frame.local_size
+
+        if instr.frame.param_size > 0:
+            yield "    /* cleaning up argument stack */"
+            yield "    SP = SP - %d;" % instr.frame.param_size
+
+        yield "    /* cleaning up return addr and old FP */"
+        yield "    SP = SP - 2;"
+
+        yield "    goto *(void *)R[0];"
@@ -0,0 +1,363 @@
+"""
+Three-address intermediate representation built by the Parser and lowered
+to C by Gen.
+
+Operands are either virtual registers (Reg), compile time constants (Const)
+or the address of a variable (Addr). Variables are referenced through their
+Symbol so that frame layout can be decided after parsing. Stack frames are
+the Scope (see symbols.py) the variables were declared in.
+"""
+
+class Reg(object):
+
+    def __init__(self, n, type=None):
+        self.n = n
+        self.type = type
+
+    def __repr__(self):
+        return "%%%d" % self.n
+
+
+class Const(object):
+
+    def __init__(self, value, type):
+        self.value = value
+        self.type = type
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+class Addr(object):
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.type = symbol.type
+
+    def __repr__(self):
+        return "&%s" % self.symbol.name
+
+
+def regs(*operands):
+    return set(x.n for x in operands if isinstance(x, Reg))
+
+
+def is_float(x):
+    """
+    Returns true if the operand is a float value (the address of a float
+    variable is not)
+    """
+    return isinstance(x, (Reg, Const)) and x.type == 'FLOAT'
+
+
+class Instr(object):
+    """
+    Base class of all instructions. The attributes below describe the
+    instruction to the data flow passes (see flow.py). 'operands' names the
+    fields holding the operands the instruction reads.
+    """
+
+    label = None
+    targets = ()
+    indirect = False
+    falls_through = True
+    address_of = ()
+    operands = ()
+    dst = None
+
+    @property
+    def defs(self):
+        return regs(self.dst)
+
+    @property
+    def uses(self):
+        return regs(*self.read())
+
+    def read(self):
+        """
+        Returns the operands read by this instruction
+        """
+        return [getattr(self, f) for f in self.operands]
+
+    def replace(self, f):
+        """
+        Replaces every operand x read by this instruction with f(x)
+        """
+        for field in self.operands:
+            x = getattr(self, field)
+            if x is not None:
+                setattr(self, field, f(x))
+
+
+class Comment(Instr):
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return "; %s" % self.text
+
+
+class SourceLine(Comment):
+    """
+    Marks the start of the code of the statement on line line_num of the
+    source file. text is the statement itself, it is left out when the C
+    code is not annotated.
+    """
+
+    def __init__(self, filename, line_num, text=None):
+        self.filename = filename
+        self.line_num = line_num
+        self.text = text
+
+    def __repr__(self):
+        return "; line %d: %s" % (self.line_num, self.text)
+
+
+class Move(Instr):
+    """ dst = src """
+
+    operands = ('src',)
+
+    def __init__(self, dst, src):
+        self.dst = dst
+        self.src = src
+
+    def __repr__(self):
+        return "%r = %r" % (self.dst, self.src)
+
+
+class UnOp(Instr):
+    """ dst = op src """
+
+    operands = ('src',)
+
+    def __init__(self, dst, op, src):
+        self.dst = dst
+        self.op = op
+        self.src = src
+
+    def __repr__(self):
+        return "%r = %s%r" % (self.dst, self.op, self.src)
+
+
+class BinOp(Instr):
+    """ dst = lhs op rhs """
+
+    operands = ('lhs', 'rhs')
+
+    def __init__(self, dst, op, lhs, rhs):
+        self.dst = dst
+        self.op = op
+        self.lhs = lhs
+        self.rhs = rhs
+
+    def __repr__(self):
+        return "%r = %r %s %r" % (self.dst, self.lhs, self.op, self.rhs)
+
+
+class Load(Instr):
+    """ dst = symbol[index] """
+
+    operands = ('index',)
+
+    def __init__(self, dst, symbol, index=None):
+        self.dst = dst
+        self.symbol = symbol
+        self.index = index
+
+    def __repr__(self):
+        if self.index is None:
+            return "%r = %s" % (self.dst, self.symbol.name)
+        return "%r = %s[%r]" % (self.dst, self.symbol.name, self.index)
+
+
+class Store(Instr):
+    """ symbol[index] = src """
+
+    operands = ('index', 'src')
+
+    def __init__(self, symbol, index, src):
+        self.symbol = symbol
+        self.index = index
+        self.src = src
+
+    def __repr__(self):
+        if self.index is None:
+            return "%s = %r" % (self.symbol.name, self.src)
+        return "%s[%r] = %r" % (self.symbol.name, self.index, self.src)
+
+
+class String(Instr):
+    """ dst = address of the string literal value """
+
+    def __init__(self, dst, value):
+        self.dst = dst
+        self.value = value
+
+    def __repr__(self):
+        return "%r = %r" % (self.dst, self.value)
+
+
+class Label(Instr):
+
+    def __init__(self, name):
+        self.label = name
+
+    def __repr__(self):
+        return "%s:" % self.label
+
+
+class Jump(Instr):
+
+    falls_through = False
+
+    def __init__(self, label):
+        self.targets = [label]
+
+    def __repr__(self):
+        return "goto %s" % self.targets[0]
+
+
+class BranchFalse(Instr):
+    """ if cond == 0 goto label """
+
+    operands = ('cond',)
+
+    def __init__(self, cond, label):
+        self.cond = cond
+        self.targets = [label]
+
+    def __repr__(self):
+        return "if not %r goto %s" % (self.cond, self.targets[0])
+
+
+class CompareBranch(Instr):
+    """ if (lhs op rhs) == when goto label """
+
+    operands = ('lhs', 'rhs')
+
+    def __init__(self, op, lhs, rhs, label, when):
+        self.op = op
+        self.lhs = lhs
+        self.rhs = rhs
+        self.when = when
+        self.targets = [label]
+
+    def __repr__(self):
+        return "if %s(%r %s %r) goto %s" % ("" if self.when else "not ", self.lhs, self.op, self.rhs, self.targets[0])
+
+
+class Call(Instr):
+    """
+    Calls a procedure. Control comes back at return_label which has to be
+    placed directly after the call.
+    """
+
+    falls_through = False
+
+    def __init__(self, symbol, args, return_label):
+        self.symbol = symbol
+        self.args = args
+        self.return_label = return_label
+        self.address_of = [return_label]
+
+    @property
+    def targets(self):
+        return [self.symbol.label]
+
+    def read(self):
+        return list(self.args)
+
+    def replace(self, f):
+        self.args = [f(x) for x in self.args]
+
+    def __repr__(self):
+        return "call %s(%s)" % (self.symbol.name, ", ".join(repr(a) for a in self.args))
+
+
+class Enter(Instr):
+    """
+    Procedure prologue. If globals is given this is the start of the main
+    program and the frame is placed right above the global variables.
+    """
+
+    def __init__(self, frame, procedure=None, globals=None):
+        self.frame = frame
+        self.procedure = procedure
+        self.globals = globals
+
+    def __repr__(self):
+        return "enter"
+
+
+class Return(Instr):
+
+    indirect = True
+    falls_through = False
+
+    def __init__(self, frame):
+        self.frame = frame
+
+    def __repr__(self):
+        return "return"
+
+
+class CountedLoop(Instr):
+    """
+    Head of a loop counting the register dst up by one from start for as
+    long as 'dst op limit' holds (see loops.py). The body follows up to the
+    matching EndLoop, which jumps back here. When the condition fails the
+    loop is left at the end label with dst holding the first value that
+    failed it.
+    """
+
+    operands = ('start', 'limit')
+
+    def __init__(self, label, counter, start, op, limit, end):
+        self.label = label
+        self.dst = counter
+        self.start = start
+        self.op = op
+        self.limit = limit
+        self.targets = [end]
+        self.strided = []   # arrays indexed by the counter in the body
+        self.arrays = []    # loads and stores of other array elements
+
+    def __repr__(self):
+        return "for %r = %r; %r %s %r" % (self.dst, self.start, self.dst, self.op, self.limit)
+
+
+class EndLoop(Instr):
+    """ counter++, back to the head of its CountedLoop """
+
+    falls_through = False
+    operands = ('counter',)
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.counter = loop.dst
+        self.targets = [loop.label]
+
+    def __repr__(self):
+        return "end for %r" % self.counter
+
+
+class CopyArray(Instr):
+    """
+    dst[k] = src[k] for every k counting up from start while 'k op limit'
+    holds. The register counter gets the value of k after the copy.
+    """
+
+    operands = ('start', 'limit')
+
+    def __init__(self, counter, dst, src, start, op, limit):
+        self.dst = counter
+        self.dst_symbol = dst
+        self.src_symbol = src
+        self.start = start
+        self.op = op
+        self.limit = limit
+
+    def __repr__(self):
+        return "%s[%r %s %r] = %s[...]" % (self.dst_symbol.name, self.start, self.op, self.limit, self.src_symbol.name)
@@ -0,0 +1,309 @@
+"""
+Loop optimizations. The parser lowers every
+
+    for (i := i + 1; i < N)
+        body
+    end for;
+
+into a label, the increment and test of i and a goto back to the label.
+When the body does not assign i or N and makes no calls the loop is turned
+into a CountedLoop, which is lowered to a C for loop keeping i in a
+register. On top of that
+
+  - computations in the body that give the same value in every iteration
+    are moved in front of the loop,
+  - arrays indexed by i are walked with a pointer that is incremented
+    along with i (see Gen.lower_countedloop),
+  - a body that only copies one array into another becomes a single
+    CopyArray (a memmove).
+
+Calls are ruled out because without -n all procedures share the same
+registers, a recursive call would overwrite i.
+"""
+
+from ir import *
+
+# instructions allowed in the body of a counted loop
+BODY = (Comment, Move, UnOp, BinOp, Load, Store, String, Label, Jump, BranchFalse, CountedLoop, EndLoop, CopyArray)
+
+class Loop:
+    """
+    The parts of a for loop found by match_loop
+    """
+
+    def __init__(self):
+        self.label = None
+        self.symbol = None      # the loop variable
+        self.start = None       # register holding i + 1
+        self.counter = None     # register holding i in the loop condition
+        self.op = None
+        self.limit = None
+        self.limit_symbol = None
+        self.end = None
+        self.header = []        # load and increment of i, loads of the limit
+        self.body = []
+
+
+def code(instrs, i):
+    """
+    Returns the index of the first instruction at or after i that is not
+    a comment
+    """
+    while i < len(instrs) and isinstance(instrs[i], Comment):
+        i += 1
+    return i
+
+def at(instrs, i):
+    return instrs[i] if i < len(instrs) else None
+
+def is_scalar(symbol):
+    # out parameters may point into an array written by the loop
+    return symbol.type == 'INTEGER' and not symbol.isarray and not symbol.indirect
+
+def may_alias(a, b):
+    """
+    Returns true if writing the variable a may change the variable b
+    """
+    if a is b:
+        return True
+    # parameters passed by address point to globals or to the variables of
+    # a caller, never to the locals of the procedure itself
+    shared = lambda s: s.isglobal or s.indirect
+    return (a.indirect and shared(b)) or (b.indirect and shared(a))
+
+def written(instrs):
+    """
+    Returns the variables the instructions store to
+    """
+    symbols = []
+    for instr in instrs:
+        if isinstance(instr, Store):
+            symbols.append(instr.symbol)
+        elif isinstance(instr, CopyArray):
+            symbols.append(instr.dst_symbol)
+    return symbols
+
+def match_loop(instrs, i, references):
+    """
+    Matches the loop starting with the label at instrs[i]. Returns the Loop
+    and the index of the instruction after it, or None if there is no
+    loop of the expected shape.
+    """
+
+    loop = Loop()
+
+    label = instrs[i]
+    if not isinstance(label, Label) or references.get(label.label) != 1:
+        return None
+    loop.label = label.label
+
+    # r1 = i; r2 = r1 + 1; i = r2
+    i = code(instrs, i + 1)
+    load, inc, store = at(instrs, i), at(instrs, i + 1), at(instrs, i + 2)
+    if not (isinstance(load, Load) and load.index is None and is_scalar(load.symbol)):
+        return None
+    loop.symbol = load.symbol
+    if not (isinstance(inc, BinOp) and inc.op == '+' and inc.lhs is load.dst and isinstance(inc.rhs, Const) and inc.rhs.value == 1):
+        return None
+    if not (isinstance(store, Store) and store.symbol is loop.symbol and store.index is None and store.src is inc.dst):
+        return None
+    loop.start = inc.dst
+    loop.header = [load, inc]
+
+    # r3 = i; [r4 = n;] r5 = r3 < limit; if not r5 goto end
+    i = code(instrs, i + 3)
+    load = at(instrs, i)
+    if not (isinstance(load, Load) and load.symbol is loop.symbol and load.index is None):
+        return None
+    loop.counter = load.dst
+
+    i = code(instrs, i + 1)
+    limit_load = None
+    if isinstance(at(instrs, i), Load) and instrs[i].index is None and is_scalar(instrs[i].symbol):
+        limit_load = instrs[i]
+        loop.limit_symbol = limit_load.symbol
+        loop.header.append(limit_load)
+        i = code(instrs, i + 1)
+
+    test = at(instrs, i)
+    if not (isinstance(test, BinOp) and test.op in ('<', '<=') and test.lhs is loop.counter):
+        return None
+    if limit_load:
+        if test.rhs is not limit_load.dst or limit_load.symbol is loop.symbol:
+            return None
+    elif not (isinstance(test.rhs, Const) and test.rhs.type == 'INTEGER'):
+        return None
+    loop.op = test.op
+    loop.limit = test.rhs
+
+    i = code(instrs, i + 1)
+    branch = at(instrs, i)
+    if not (isinstance(branch, BranchFalse) and branch.cond is test.dst):
+        return None
+    loop.end = branch.targets[0]
+    if references.get(loop.end) != 1:
+        return None
+
+    # body; goto label; end:
+    i += 1
+    while i < len(instrs) and isinstance(instrs[i], BODY):
+        if isinstance(instrs[i], Jump) and instrs[i].targets[0] == loop.label:
+            break
+        loop.body.append(instrs[i])
+        i += 1
+
+    jump, end = at(instrs, i), at(instrs, i + 1)
+    if not (isinstance(jump, Jump) and jump.targets[0] == loop.label):
+        return None
+    if not (isinstance(end, Label) and end.label == loop.end):
+        return None
+
+    # neither i nor the limit may change in the body and the body may only
+    # jump around in itself
+    for symbol in written(loop.body):
+        if may_alias(symbol, loop.symbol):
+            return None
+        if loop.limit_symbol and may_alias(symbol, loop.limit_symbol):
+            return None
+
+    # i is only written back after the loop, reading it through an out
+    # parameter in the body would see the old value
+    for instr in loop.body:
+        if isinstance(instr, Load) and instr.symbol is not loop.symbol and may_alias(instr.symbol, loop.symbol):
+            return None
+
+    labels = set(x.label for x in loop.body if x.label)
+    for instr in loop.body:
+        if not labels.issuperset(instr.targets):
+            return None
+
+    return loop, i + 2
+
+def copied_arrays(loop):
+    """
+    Returns (dst, src) if the body only does dst[i] := src[i], else None
+    """
+    body = [x for x in loop.body if not isinstance(x, Comment)]
+    if len(body) != 2:
+        return None
+    load, store = body
+    if not (isinstance(load, Load) and load.symbol.isarray and load.index is loop.counter):
+        return None
+    if not (isinstance(store, Store) and store.symbol.isarray and store.index is loop.counter and store.src is load.dst):
+        return None
+    if store.symbol is load.symbol:
+        return None
+    return store.symbol, load.symbol
+
+def is_invariant(instr, variant, stored):
+    """
+    Returns true if instr computes the same value in every iteration of a
+    loop. 'variant' are the registers that may change from one iteration to
+    the next, 'stored' the variables written in the loop.
+    """
+
+    if instr.uses & variant:
+        return False
+
+    # division could trap if the loop does not run at all
+    if isinstance(instr, BinOp):
+        return instr.op != '/'
+
+    if isinstance(instr, Load):
+        if instr.index is not None:
+            return False
+        return not any(may_alias(s, instr.symbol) for s in stored)
+
+    return isinstance(instr, (Move, UnOp, String))
+
+def hoist_invariants(loop):
+    """
+    Moves the instructions of the body that compute the same value in every
+    iteration in front of the loop. Returns them in order.
+    """
+
+    # the loop variable changes every iteration even though its store is
+    # moved behind the loop
+    stored = written(loop.body) + [loop.symbol]
+    variant = set([loop.counter.n])
+    hoisted = []
+    body = []
+
+    for instr in loop.body:
+        if instr.dst is not None and is_invariant(instr, variant, stored):
+            hoisted.append(instr)
+        else:
+            variant |= instr.defs
+            body.append(instr)
+
+    loop.body = body
+    return hoisted
+
+def lower_loop(loop, references):
+    """
+    Returns the instructions replacing the matched loop
+    """
+
+    # loops nested in the body come first so that whatever they hoisted
+    # can be hoisted further out of this loop
+    loop.body = counted_loops(loop.body, references)
+
+    # the loop variable stays in the counter register for the whole loop
+    # and is only written back once it is done
+    loads = set(x.dst.n for x in loop.body if isinstance(x, Load) and x.symbol is loop.symbol)
+    body = [x for x in loop.body if not (isinstance(x, Load) and x.dst.n in loads)]
+    for instr in body:
+        instr.replace(lambda x: loop.counter if isinstance(x, Reg) and x.n in loads else x)
+    loop.body = body
+
+    instrs = list(loop.header)
+
+    copy = copied_arrays(loop)
+    if copy:
+        instrs.append(CopyArray(loop.counter, copy[0], copy[1], loop.start, loop.op, loop.limit))
+    else:
+        instrs.extend(hoist_invariants(loop))
+        head = CountedLoop(loop.label, loop.counter, loop.start, loop.op, loop.limit, loop.end)
+        for instr in loop.body:
+            if isinstance(instr, (Load, Store)) and instr.symbol.isarray:
+                if instr.index is not loop.counter:
+                    head.arrays.append(instr)
+                elif instr.symbol not in head.strided:
+                    head.strided.append(instr.symbol)
+        instrs.append(head)
+        instrs.extend(loop.body)
+        instrs.append(EndLoop(head))
+        instrs.append(Label(loop.end))
+
+    instrs.append(Store(loop.symbol, None, loop.counter))
+    return instrs
+
+def count_references(instrs):
+    references = {}
+    for instr in instrs:
+        for label in instr.targets:
+            references[label] = references.get(label, 0) + 1
+    return references
+
+def counted_loops(instrs, references=None):
+    """
+    Replaces every for loop that is simple enough by a CountedLoop or a
+    CopyArray
+    """
+
+    if references is None:
+        references = count_references(instrs)
+
+    result = []
+    i = 0
+
+    while i < len(instrs):
+        match = match_loop(instrs, i, references)
+        if match:
+            loop, i = match
+            result.extend(lower_loop(loop, references))
+        else:
+            result.append(instrs[i])
+            i += 1
+
+    return result
@@ -0,0 +1,156 @@
+from ir import *
+from gen import Gen, runtime_source
+
+class NativeGen(Gen):
+    """
+    Lowers every procedure into its own C function so gcc can optimize
+    across calls. Parameters and local variables become C variables, out
+    parameters and arrays are passed as pointers. Globals and the string
+    literal pool stay in M[] like in the default mode.
+    """
+
+    def write(self, f):
+
+        functions = self.functions()
+        self.layout_strings()
+
+        f.write('#include <runtime.h>\n\n')
+        f.writelines(line + '\n' for line in self.limits())
+        f.writelines(line + '\n' for line in self.pool_declaration())
+        f.write(runtime_source('runtime_native.c'))
+        f.write('\n')
+        for procedure, instrs in functions:
+            if procedure:
+                f.write('static %s;\n' % self.prototype(procedure))
+        f.write('\n')
+        for procedure, instrs in functions:
+            f.writelines(line + '\n' for line in self.function(procedure, instrs))
+            f.write('\n')
+
+    def functions(self):
+        """
+        Splits the IR into one list of instructions per procedure. Every
+        procedure starts with its label followed by its Enter instruction.
+        Returns a list of (procedure symbol, instructions), the main program
+        has None as its symbol.
+        """
+
+        functions = []
+        instrs = []
+
+        for instr in self.instrs:
+            if isinstance(instr, Enter):
+                label = instrs.pop() if instrs and isinstance(instrs[-1], Label) else None
+                instrs = [label] if label else []
+                functions.append((instr.procedure, instrs))
+            instrs.append(instr)
+
+        return functions
+
+    def prototype(self, procedure):
+        params = []
+        for p in procedure.params:
+            if p.indirect:
+                params.append("int *v_%s" % p.name)
+            else:
+                params.append("int v_%s" % p.name)
+        # nested procedures in different parents may share a name, labels
+        # are unique
+        return "void p_%s(%s)" % (procedure.label, ", ".join(params))
+
+    def function(self, procedure, instrs):
+
+        enter = [x for x in instrs if isinstance(x, Enter)][0]
+
+        self.procedure = procedure
+        self.return_labels = set(x.return_label for x in instrs if isinstance(x, Call))
+
+        if procedure:
+            yield "static %s {" % self.prototype(procedure)
+        else:
+            yield "int main(void) {"
+
+        regs = set()
+        for instr in instrs:
+            regs |= instr.defs | instr.uses
+        names = sorted(set(self.reg_names[r] for r in regs if r in self.reg_names))
+        int_names = [x for x in names if x.startswith('r')]
+        float_names = [x for x in names if x.startswith('f')]
+        if int_names:
+            yield "    int %s;" % ", ".join(int_names)
+        if float_names:
+            yield "    float %s;" % ", ".join(float_names)
+
+        for symbol in sorted(enter.frame.variables(), key=lambda s: s.addr):
+            if symbol.isparam:
+                continue
+            if symbol.isarray:
+                yield "    int v_%s[%d];" % (symbol.name, symbol.size)
+            else:
+                yield "    int v_%s;" % symbol.name
+
+        for instr in instrs:
+            for line in self.lower_instr(instr):
+                yield line
+
+        if not procedure:
+            yield "    return 0;"
+
+        yield "}"
+
+    def storage(self, symbol, index=None):
+        if symbol.isglobal:
+            return "M[%s]" % self.address(symbol, index)
+        if index is not None:
+            return "v_%s[%s]" % (symbol.name, self.operand(index))
+        if symbol.indirect:
+            return "*v_%s" % symbol.name
+        return "v_%s" % symbol.name
+
+    def base_pointers(self, loop):
+        # arrays already are C arrays or pointers
+        return []
+
+    def walked_arrays(self, loop):
+        # gcc strength reduces the indexing of C arrays itself
+        return []
+
+    def operand(self, x):
+        if not isinstance(x, Addr):
+            return Gen.operand(self, x)
+        symbol = x.symbol
+        if symbol.isglobal:
+            return "&M[%d]" % symbol.addr
+        if symbol.indirect or symbol.isarray:
+            return "v_%s" % symbol.name
+        return "&v_%s" % symbol.name
+
+    def lower_label(self, instr):
+        if instr.label in self.return_labels:
+            return
+        # the function itself replaces the entry label
+        if instr.label == (self.procedure.label if self.procedure else 'main'):
+            return
+        yield "%s:" % instr.label
+
+    def lower_call(self, instr):
+        args = ", ".join(self.bits(x) for x in instr.args)
+        yield "    p_%s(%s);" % (instr.symbol.label, args)
+
+    def lower_enter(self, instr):
+        if instr.globals:
+            yield "    INIT_HEAP();"
+            if self.checks:
+                # calls use the C stack, running out of it is caught as a
+                # segmentation fault
+                yield "    initChecks();"
+            for line in self.load_string_pool():
+                yield line
+            yield "    /* stack starts at top of string literals */"
+            yield "    SP = %d;" % (self.string_base + self.string_size)
+
+    def lower_return(self, instr):
+        if self.procedure:
+            yield "    return;"
+        else:
+            yield "    return 0;"
@@ -0,0 +1,394 @@
+"""
+Optimization passes over the IR. Every pass takes the list of instructions
+built by Gen and returns the optimized list.
+"""
+
+from ir import *
+from loops import counted_loops
+from flow import build_blocks, reachable
+
+# instructions that only compute a value into their destination register
+PURE = (Move, UnOp, BinOp, Load, String)
+
+def int32(x):
+    """
+    Wraps a python integer the same way a 32 bit C int would
+    """
+    x &= 0xffffffff
+    return x - 0x100000000 if x & 0x80000000 else x
+
+def is_const(x):
+    # python floats are doubles, folding float arithmetic would round
+    # differently than the C float code does, so only integer and boolean
+    # arithmetic is done at compile time
+    return isinstance(x, Const) and x.type in ('INTEGER', 'BOOL')
+
+def evaluate(op, lhs, rhs=None):
+    """
+    Evaluates a C operator on compile time integers. Returns None if the
+    result can only be known at run time.
+    """
+
+    if rhs is None:
+        if op == '-': return int32(-lhs)
+        if op == '~': return int32(~lhs)
+        return None
+
+    if op == '+':  return int32(lhs + rhs)
+    if op == '-':  return int32(lhs - rhs)
+    if op == '*':  return int32(lhs * rhs)
+    if op == '&':  return int32(lhs & rhs)
+    if op == '|':  return int32(lhs | rhs)
+    if op == '<':  return int(lhs < rhs)
+    if op == '>':  return int(lhs > rhs)
+    if op == '<=': return int(lhs <= rhs)
+    if op == '>=': return int(lhs >= rhs)
+    if op == '==': return int(lhs == rhs)
+    if op == '!=': return int(lhs != rhs)
+
+    if op == '/':
+        # leave division by zero for the run time to deal with
+        if rhs == 0:
+            return None
+        # C division truncates towards zero
+        q = abs(lhs) // abs(rhs)
+        return int32(q if (lhs < 0) == (rhs < 0) else -q)
+
+    return None
+
+def simplify(instr):
+    """
+    Returns the operand an arithmetic identity reduces 'instr' to (e.g. x + 0)
+    or None if there is no such identity.
+    """
+
+    lhs, rhs = instr.lhs, instr.rhs
+
+    if is_const(rhs):
+        if instr.op in ('+', '-') and rhs.value == 0: return lhs
+        if instr.op in ('*', '/') and rhs.value == 1: return lhs
+
+    if is_const(lhs):
+        if instr.op == '+' and lhs.value == 0: return rhs
+        if instr.op == '*' and lhs.value == 1: return rhs
+
+    return None
+
+def fold_constants(instrs):
+    """
+    Constant folding and propagation. Every register is only assigned once
+    so whatever a register is known to hold can be substituted into all of
+    its uses.
+    """
+
+    values = {}     # register number -> operand it is known to hold
+
+    def value(x):
+        if isinstance(x, Reg):
+            return values.get(x.n, x)
+        return x
+
+    result = []
+
+    for instr in instrs:
+
+        instr.replace(value)
+
+        if isinstance(instr, Move):
+            if is_const(instr.src) or isinstance(instr.src, Reg):
+                values[instr.dst.n] = instr.src
+
+        elif isinstance(instr, UnOp) and is_const(instr.src):
+            x = evaluate(instr.op, instr.src.value)
+            if x is not None:
+                values[instr.dst.n] = Const(x, instr.dst.type)
+                instr = Move(instr.dst, values[instr.dst.n])
+
+        elif isinstance(instr, BinOp):
+            x = None
+            if is_const(instr.lhs) and is_const(instr.rhs):
+                x = evaluate(instr.op, instr.lhs.value, instr.rhs.value)
+            if x is not None:
+                values[instr.dst.n] = Const(x, instr.dst.type)
+                instr = Move(instr.dst, values[instr.dst.n])
+            elif simplify(instr) is not None:
+                values[instr.dst.n] = simplify(instr)
+                instr = Move(instr.dst, values[instr.dst.n])
+
+        elif isinstance(instr, BranchFalse) and is_const(instr.cond):
+            # the branch is either always or never taken
+            if instr.cond.value != 0:
+                continue
+            instr = Jump(instr.targets[0])
+
+        result.append(instr)
+
+    return remove_unused_values(result)
+
+def remove_unused_values(instrs):
+    """
+    Removes instructions without side effects whose result register is
+    never read. Registers are always defined before they are used so a
+    single backwards scan finds them all.
+    """
+
+    used = set()
+    result = []
+
+    for instr in reversed(instrs):
+        if isinstance(instr, PURE) and instr.dst.n not in used:
+            continue
+        used |= instr.uses
+        result.append(instr)
+
+    result.reverse()
+    return result
+
+def eliminate_dead_code(instrs):
+    """
+    Removes stores to variables that are never read, code that can never be
+    reached and shrinks the stack frames down to the variables that are
+    still referenced.
+    """
+
+    instrs = [x for x in instrs if not is_dead_store(x)]
+    instrs = remove_unused_values(instrs)
+    instrs = remove_unreachable(instrs)
+    layout_frames(instrs)
+    return instrs
+
+def is_dead_store(instr):
+    # parameters are part of the calling convention, out parameters in
+    # particular are only ever written
+    if not isinstance(instr, Store):
+        return False
+    return not instr.symbol.used and not instr.symbol.isparam
+
+def remove_unreachable(instrs):
+    """
+    Drops the code that can not be reached from the start of the main
+    program, then labels nothing jumps to and gotos to the label directly
+    following them. The latter is repeated until nothing changes since a
+    removed goto may have been the only reference to a label.
+    """
+
+    # procedures are only reached through their calls, the code after a
+    # call through the return of the procedure
+    blocks = build_blocks(instrs)
+    live = reachable(blocks, set(['main']))
+    instrs = [x for b in blocks if b.index in live for x in b.instrs]
+
+    while True:
+
+        referenced = set(['main'])
+        for instr in instrs:
+            referenced.update(instr.targets)
+            referenced.update(instr.address_of)
+
+        result = []
+
+        for i, instr in enumerate(instrs):
+
+            if isinstance(instr, Label) and instr.label not in referenced:
+                continue
+
+            if isinstance(instr, Jump) and jumps_to_next(instrs, i):
+                continue
+
+            result.append(instr)
+
+        if len(result) == len(instrs):
+            return result
+
+        instrs = result
+
+def jumps_to_next(instrs, i):
+    """
+    Returns true if the goto at instrs[i] jumps to one of the labels
+    directly following it
+    """
+    for instr in instrs[i+1:]:
+        if not isinstance(instr, (Label, Comment)):
+            return False
+        if instr.label == instrs[i].targets[0]:
+            return True
+    return False
+
+def layout_frames(instrs):
+    """
+    Reassigns the addresses of all variables so that variables which are no
+    longer referenced by any instruction do not take up space in their frame
+    """
+
+    referenced = set()
+    frames = []
+
+    for instr in instrs:
+        if isinstance(instr, (Load, Store)):
+            referenced.add(instr.symbol)
+        for x in instr.read():
+            if isinstance(x, Addr):
+                referenced.add(x.symbol)
+        if isinstance(instr, Enter):
+            frames.append(instr.frame)
+            if instr.globals:
+                frames.append(instr.globals)
+
+    for frame in frames:
+
+        variables = sorted(frame.variables(), key=lambda s: s.addr)
+
+        # parameter addresses are fixed by the order the caller pushes them
+        addr = frame.param_size
+
+        for symbol in variables:
+            if symbol.isparam:
+                continue
+            if symbol not in referenced:
+                frame.remove(symbol)
+                continue
+            symbol.addr = addr
+            addr += symbol.size
+
+RELATIONS = ('<', '>', '<=', '>=', '==', '!=')
+
+class Condition:
+    """
+    Rewrites the computation of a condition and the branch on it into
+    branches on its parts
+    """
+
+    def __init__(self, window, cond, uses, new_label):
+
+        self.uses = uses
+        self.new_label = new_label
+
+        # the instructions computing the condition that are not needed by
+        # anything else can be moved behind the branches
+        defs = dict((x.dst.n, x) for x in window if isinstance(x, PURE))
+        self.tree = {}
+
+        def collect(x):
+            if isinstance(x, Reg) and x.n in defs and uses.get(x.n) == 1:
+                self.tree[x.n] = defs[x.n]
+                for y in defs[x.n].read():
+                    collect(y)
+
+        collect(cond)
+        self.code = [x for x in window if not (isinstance(x, PURE) and x.dst.n in self.tree)]
+
+    def definition(self, x):
+        if isinstance(x, Reg):
+            return self.tree.get(x.n)
+        return None
+
+    def is_bool(self, x):
+        """
+        Returns true if x is known to be either 0 or 1. Only then & and |
+        can be short circuited, they are bitwise operations on any other
+        values.
+        """
+        if isinstance(x, Const):
+            return x.type == 'BOOL' and x.value in (0, 1)
+        d = self.definition(x)
+        if isinstance(d, BinOp) and d.op in RELATIONS:
+            return True
+        if isinstance(d, BinOp) and d.op in ('&', '|'):
+            return self.is_bool(d.lhs) and self.is_bool(d.rhs)
+        return False
+
+    def value(self, x):
+        """
+        Emits the instructions computing x, if they were moved
+        """
+        d = self.definition(x)
+        if d is None:
+            return
+        del self.tree[x.n]
+        for y in d.read():
+            self.value(y)
+        self.code.append(d)
+
+    def branch(self, x, label, when):
+        """
+        Emits a jump to label for the case that x is true (when) or false
+        """
+
+        d = self.definition(x)
+
+        if isinstance(d, BinOp) and d.op in RELATIONS:
+            del self.tree[x.n]
+            self.value(d.lhs)
+            self.value(d.rhs)
+            self.code.append(CompareBranch(d.op, d.lhs, d.rhs, label, when))
+
+        elif isinstance(d, BinOp) and d.op in ('&', '|') and self.is_bool(d.lhs) and self.is_bool(d.rhs):
+            del self.tree[x.n]
+            if (d.op == '|') == when:
+                # either side alone can decide to jump
+                self.branch(d.lhs, label, when)
+                self.branch(d.rhs, label, when)
+            else:
+                # if the left side decides it is not jumping the right side
+                # does not need to be looked at
+                skip = self.new_label()
+                self.branch(d.lhs, skip, not when)
+                self.branch(d.rhs, label, when)
+                self.code.append(Label(skip))
+
+        else:
+            self.value(x)
+            if when:
+                self.code.append(CompareBranch('!=', x, Const(0, x.type), label, True))
+            else:
+                self.code.append(BranchFalse(x, label))
+
+def fuse_branches(instrs):
+    """
+    Branches directly on the conditions of if statements and loops instead
+    of computing them into a register and testing that. Relations become a
+    single compare and branch, & and | of conditions jump as soon as the
+    outcome is known and only compute their right hand side if needed.
+    """
+
+    uses = {}
+    for instr in instrs:
+        for x in instr.read():
+            if isinstance(x, Reg):
+                uses[x.n] = uses.get(x.n, 0) + 1
+
+    count = [0]
+    def new_label():
+        count[0] += 1
+        return "cond_%d" % count[0]
+
+    result = []
+
+    for instr in instrs:
+
+        if isinstance(instr, BranchFalse) and isinstance(instr.cond, Reg):
+            # the condition is computed by the pure instructions right in
+            # front of the branch
+            start = len(result)
+            while start > 0 and isinstance(result[start-1], PURE + (Comment,)):
+                start -= 1
+            condition = Condition(result[start:], instr.cond, uses, new_label)
+            condition.branch(instr.cond, instr.targets[0], False)
+            result[start:] = condition.code
+            continue
+
+        result.append(instr)
+
+    return result
+
+# passes run at every optimization level, in order
+PASSES = {
+    0: [],
+    1: [fold_constants, eliminate_dead_code, fuse_branches],
+    2: [fold_constants, eliminate_dead_code, counted_loops, fuse_branches],
+}
+
+def optimize(instrs, level):
+    for optimization in PASSES[level]:
+        instrs = optimization(instrs)
+    return instrs
@@ -2,7 +2,9 @@
 
 from contextlib import contextmanager
 from tokens import Tokens
-from color import Color
+from diagnostic import Diagnostic
+from ir import Const, Addr
+from symbols import Scope
 
 class Symbol:
 
@@ -11,7 +13,7 @@ class Symbol:
         self.type = type
         self.size = size
         self.addr = 0
-        self.used = False
+        self.used = False # value is read (or its address taken) somewhere
         self.params = []
         self.label = name
         self.direction = direction
@@ -29,6 +31,18 @@ class Symbol:
             return "<%r, %r, size=%r, addr=%r>" % (self.name, self.type, self.size, self.addr)
 
 
+# the procedures of the runtime: (name, parameter type, parameter direction)
+BUILTINS = [
+    ('putinteger', "INTEGER", "in"),
+    ('putbool', "BOOL", "in"),
+    ('putstring', "STRING", "in"),
+    ('putfloat', "FLOAT", "in"),
+    ('getinteger', "INTEGER", "out"),
+    ('getbool', "BOOL", "out"),
+    ('getstring', "STRING", "out"),
+    ('getfloat', "FLOAT", "out"),
+]
+
 # scan error is raised when the parser encounters an invalid token
 class ScanError(Exception): pass
 
@@ -43,13 +57,13 @@ class Parser:
     def __init__(self, scanner, gen):
 
         self.has_errors = False
+        self.has_warnings = False
         self.matched_token = None
         self.token = None
 
         self.scope_level = 0
-        self.global_symbols = {}
-        self.symbols = [{}]
-        self.global_addr = 0    # absolute address = global_addr
+        self.global_symbols = Scope()
+        self.symbols = [Scope(self.global_symbols)]
         self.local_addr = 0     # absolute address = FP + local_addr
         self.current_procedure = None # symbol name of current procedure
 
@@ -59,58 +73,32 @@ class Parser:
         self.get_next_token()
 
         # add the built-in function to the symbol table
-        self.global_symbols['putinteger'] = Symbol('putinteger')
-        self.global_symbols['putinteger'].type = 'procedure'
-        self.global_symbols['putinteger'].params.append(Symbol(type="INTEGER", direction="in"))
-
-        self.global_symbols['putbool'] = Symbol('putbool')
-        self.global_symbols['putbool'].type = 'procedure'
-        self.global_symbols['putbool'].params.append(Symbol(type="BOOL", direction="in"))
-
-        self.global_symbols['putstring'] = Symbol('putstring')
-        self.global_symbols['putstring'].type = 'procedure'
-        self.global_symbols['putstring'].params.append(Symbol(type="STRING", direction="in"))
-
-        self.global_symbols['putfloat'] = Symbol('putfloat')
-        self.global_symbols['putfloat'].type = 'procedure'
-        self.global_symbols['putfloat'].params.append(Symbol(type="FLOAT", direction="in"))
-
-        self.global_symbols['getinteger'] = Symbol('getinteger')
-        self.global_symbols['getinteger'].type = 'procedure'
-        self.global_symbols['getinteger'].params.append(Symbol(type="INTEGER", direction="out"))
-
-        self.global_symbols['getbool'] = Symbol('getbool')
-        self.global_symbols['getbool'].type = 'procedure'
-        self.global_symbols['getbool'].params.append(Symbol(type="BOOL", direction="out"))
-
-        self.global_symbols['getstring'] = Symbol('getstring')
-        self.global_symbols['getstring'].type = 'procedure'
-        self.global_symbols['getstring'].params.append(Symbol(type="STRING", direction="out"))
-
-        self.global_symbols['getfloat'] = Symbol('getfloat')
-        self.global_symbols['getfloat'].type = 'procedure'
-        self.global_symbols['getfloat'].params.append(Symbol(type="FLOAT", direction="out"))
+        for name, type, direction in BUILTINS:
+            symbol = Symbol(name, 'procedure')
+            symbol.params.append(Symbol(type=type, direction=direction))
+            self.global_symbols.declare(symbol)
 
         self.program()
 
     def warning(self, message, token=None):
 
-        self.print_message(message, label="warning", token=token, color=Color.YELLOW)
+        self.has_warnings = True
+        self.print_message(message, label="warning", token=token)
 
     def error(self, message, token=None, after_token=False):
 
         self.has_errors = True
-        self.print_message(message, label="error", token=token, after_token=after_token, color=Color.RED)
+        self.print_message(message, label="error", token=token, after_token=after_token)
 
-    def print_message(self, message, label="info", token=None, after_token=False, color=Color.WHITE):
+    def print_message(self, message, label="info", token=None, after_token=False):
 
         if token is None:
             token = self.token
 
         col_num = token.col_num
         line_num = token.line_num
-        filename = token.filename
-        line_str = token.line_str
+        filename = self.scanner.filename
+        line_str = self.scanner.line_text(line_num)
 
         # calculate the start of the printed mark by ignoring all leading whitespace
         mark_start = col_num - (len(line_str) - len(line_str.lstrip()))
@@ -121,9 +109,8 @@ class Parser:
             mark_start = mark_start + mark_length
             mark_length = 1
 
-        print Color.BOLD + Color.WHITE + "%s:%s:%s: " % (filename, line_num, col_num) + color + "%s: " % label + Color.WHITE + message
-        print Color.DEFAULT + line_str.strip()
-        print Color.GREEN + "%s^%s" % (' '*(mark_start-1), '~'*(mark_length-1)) + Color.DEFAULT
+        # diagnostics of the scanner and parser are kept together in order
+        self.scanner.report(Diagnostic(label, message, filename, line_num, col_num, line_str, mark_start, mark_length))
 
     def get_next_token(self):
 
@@ -196,7 +183,8 @@ class Parser:
             if find: self.skip_until(find, consume)
 
     def enter_scope(self):
-        self.symbols.append({})
+        # procedures only see their own symbols and the global ones
+        self.symbols.append(Scope(self.global_symbols))
         self.scope_level += 1
         self.local_addr = 0
 
@@ -209,65 +197,26 @@ class Parser:
 
     def cur_symbols(self):
         """
-        Returns a list of symbol names in the current scope
+        Returns the current scope, 'name in self.cur_symbols()' tells if a
+        name is visible here
         """
-        return self.symbols[-1].keys() + self.global_symbols.keys()
+        return self.symbols[-1]
 
     def add_symbol(self, x, is_global=False):
         """
         Adds a symbol to the current scope
         """
         if is_global:
-            self.global_symbols[x.name] = x
-            self.global_symbols[x.name].addr = self.global_addr
-            self.global_symbols[x.name].isglobal = True
-            if x.type != 'procedure':
-                self.global_addr += x.size
+            self.global_symbols.declare(x)
+            x.isglobal = True
         else:
-            addr = self.local_symbols_size() + self.local_param_size()
-            self.symbols[-1][x.name] = x
-            self.symbols[-1][x.name].addr = addr
-
-    def local_param_size(self):
-        """
-        Returns the size in byte of the local paramters
-        """
-        size = 0
-        for s in self.symbols[-1]:
-            if self.symbols[-1][s].type == 'procedure': continue
-            if not self.symbols[-1][s].isparam: continue
-            size += 1
-        return size
-
-    def local_symbols_size(self):
-        """
-        Returns the size in bytes of the local symbols
-        """
-        size = 0
-        for s in self.symbols[-1]:
-            if self.symbols[-1][s].type == 'procedure': continue
-            if self.symbols[-1][s].isparam: continue
-            #if self.symbols[-1][s].isparam: continue
-            size += self.symbols[-1][s].size
-        return size
-
-    def global_symbols_size(self):
-        """
-        Returns the size in bytes of the global symbols
-        """
-        size = 0
-        for s in self.global_symbols:
-            if self.global_symbols[s].type == 'procedure': continue
-            size += self.global_symbols[s].size
-        return size
+            self.symbols[-1].declare(x)
 
     def get_symbol(self, x):
-        if x in self.global_symbols:
-            return self.global_symbols[x]
-        elif x in self.symbols[-1]:
-            return self.symbols[-1][x]
-        else:
+        symbol = self.symbols[-1].lookup(x)
+        if symbol is None:
             raise ParseError("Tried to lookup unknown symbol: %r" % x)
+        return symbol
 
     def program(self):
         """
@@ -298,14 +247,9 @@ class Parser:
 
         self.gen.put_label("main")
 
-        self.gen.comment("starting fp at top of global vars")
-        self.gen.set_fp(self.global_symbols_size())
-
-        self.gen.comment("resetting sp to fp")
-        self.gen.set_sp_to_fp()
-
-        self.gen.comment("moving sp to top of local vars")
-        self.gen.inc_sp(self.local_symbols_size())
+        # the frame size is only decided once the optimizer is done with the
+        # statements, the scope is the frame
+        self.gen.enter(self.symbols[-1], globals=self.global_symbols)
 
         self.statements()
 
@@ -374,12 +318,7 @@ class Parser:
         self.gen.put_label(label)
         self.get_symbol(name).label = label
 
-        #self.gen.comment("setting fp")
-        #self.gen.set_fp_to_sp()
-
-        if self.local_symbols_size() > 0:
-            self.gen.comment("moving sp to top of local vars")
-            self.gen.inc_sp(self.local_symbols_size())
+        self.gen.enter(self.symbols[-1], procedure=self.get_symbol(name))
 
         # map parameter symbol address to point to correct location
         # with in the stack frame
@@ -393,14 +332,11 @@ class Parser:
         self.gen.comment("statements")
         self.statements()
 
-        self.gen.return_to_caller(self.local_param_size(), self.local_symbols_size())
+        self.gen.return_to_caller(self.symbols[-1])
 
         if not self.match(Tokens.KEYWORD, "procedure"):
             self.error("expected 'procedure' but found '%s'" % self.token.value)
 
-        # extra new line after each function block
-        self.gen.write("", indent="")
-
 
     def procedure_header(self, is_global):
         """
@@ -464,8 +400,7 @@ class Parser:
         <parameter> ::= <variable_declaration> (in|out)
         """
 
-        symbol = self.variable_declaration()
-        symbol.isparam = True
+        symbol = self.variable_declaration(is_param=True)
 
         if self.token.type != Tokens.KEYWORD:
             raise ParseError("expected keyword 'in' or 'out'", self.token)
@@ -483,7 +418,7 @@ class Parser:
 
         return symbol
 
-    def variable_declaration(self, is_global=False):
+    def variable_declaration(self, is_global=False, is_param=False):
         """
         <variable_declaration> ::= <type_mark><identifier>
                                    [[<array_size>]]
@@ -529,6 +464,7 @@ class Parser:
         symbol = Symbol(name, typemark, size=size)
         symbol.isarray = isarray
         symbol.isstring = isstring
+        symbol.isparam = is_param
         self.add_symbol(symbol, is_global)
 
         return symbol
@@ -551,7 +487,10 @@ class Parser:
                         | <procedure_call>
                         | <return_statement>
         """
-        self.gen.comment("statement: %s" % self.token.line_str.strip())
+        # the text of the statement is only needed to annotate the C code
+        line_num = self.token.line_num
+        text = None if self.gen.compact else self.scanner.line_text(line_num).strip()
+        self.gen.source_line(self.scanner.filename, line_num, text)
         if self.if_statement():         return
         if self.loop_statement():       return
         if self.procedure_call():       return
@@ -583,7 +522,7 @@ class Parser:
         if not self.match(Tokens.KEYWORD, "return"):
             return False
 
-        self.gen.return_to_caller(self.local_param_size(), self.local_symbols_size())
+        self.gen.return_to_caller(self.symbols[-1])
         return True
 
     def procedure_call(self):
@@ -616,38 +555,14 @@ class Parser:
         if not self.match(Tokens.SYMBOL, '('):
             self.error("expected '('")
 
-        self.gen.comment("calling %s" % name)
-
-        args = self.argument_list(name)
+        args = []
+        if self.get_symbol(name).params or self.token.value != ')':
+            args = self.argument_list(name)
 
         if not self.match(Tokens.SYMBOL, ')'):
             self.error("expected ')' after argument list")
 
-        # generate a label that we will return to after call is complete
-        return_label = self.gen.new_label("return_from_%s" % name)
-
-        # push return address onto the stack
-        self.gen.comment("pushing return address onto stack")
-        reg = self.gen.set_new_reg("(int)&&%s" % return_label)
-        self.gen.push_stack(reg)
-
-        # push current frame pointer onto the stack
-        self.gen.comment("pushing current FP onto stack")
-        reg = self.gen.set_new_reg("FP")
-        self.gen.push_stack(reg)
-
-        # new frame for this call
-        self.gen.set_fp_to_sp()
-
-        # push the addresses of all arguments onto the stack
-        self.gen.comment("pushing args onto stack")
-        for i, (addr, _) in enumerate(args):
-            self.gen.push_stack(addr)
-
-        #self.gen.increment_fp(len(args)+
-
-        self.gen.goto_label(self.get_symbol(name).label)
-        self.gen.put_label(return_label)
+        self.gen.call(self.get_symbol(name), [addr for addr, _ in args])
 
         return True
 
@@ -660,12 +575,18 @@ class Parser:
 
         arguments = []
         argument_idx = 0
+        params = self.get_symbol(procedure_name).params
 
         while True:
 
+            if argument_idx == len(params):
+                with self.resync([')', '\n']):
+                    raise ParseError("too many arguments, '%s' takes %d" % (procedure_name, len(params)))
+                break
+
             with self.resync([',', ')', '\n']):
 
-                direction = self.get_symbol(procedure_name).params[argument_idx].direction
+                direction = params[argument_idx].direction
 
                 if direction == 'in':
                     """
@@ -678,18 +599,12 @@ class Parser:
 
                     if exp_addr is None:
                         if tok_type == Tokens.IDENTIFIER and self.get_symbol(name).isarray:
-                            self.gen.comment("Loading array '%s' into registers" % name)
-                            if self.get_symbol(name).isglobal:
-                                r = self.gen.set_new_reg("%s" % self.get_symbol(name).addr)
-                            else:
-                                r = self.gen.set_new_reg("FP + %s" % self.get_symbol(name).addr)
-                            arguments.append((r, self.token.type))
+                            arguments.append((Addr(self.get_symbol(name)), self.token.type))
                             exp_type = self.get_symbol(name).type
                             self.get_symbol(name).used = True
                         else:
                             raise ParseError("expected array indentifier or expression")
                     else:
-                        self.gen.comment("Loaded expression into register")
                         arguments.append((exp_addr, exp_type))
                 else:
                     if not self.match(Tokens.IDENTIFIER):
@@ -698,29 +613,25 @@ class Parser:
                     if name not in self.cur_symbols():
                         raise ParseError("undefined identifier", token=self.prev_token)
 
-                    self.gen.comment("Loading %s into register" % name)
-                    # if its not global we need to return the address relative to our current frame pointer
-                    if self.get_symbol(name).isparam and self.get_symbol(name).direction == 'out':
-                        exp_addr = self.gen.set_new_reg("M[FP+%s]" % self.get_symbol(name).addr)
-                    elif self.get_symbol(name).isglobal:
-                        exp_addr = self.gen.set_new_reg("M[%s]" % self.get_symbol(name).addr)
-                    else:
-                        exp_addr = self.gen.set_new_reg("FP + %s" % self.get_symbol(name).addr)
-
+                    # out parameters are passed by address
+                    exp_addr = Addr(self.get_symbol(name))
                     exp_type = self.get_symbol(name).type
+                    self.get_symbol(name).used = True
 
                     arguments.append((exp_addr, exp_type))
 
-                expected_type = self.get_symbol(procedure_name).params[argument_idx].type
+                expected_type = params[argument_idx].type
                 if exp_type != expected_type:
                     self.error("argument type miss-match. expected '%s' but found '%s'" % (expected_type, exp_type), self.prev_token)
 
-                argument_idx += 1
-                # TODO: check number of arguments match
+            argument_idx += 1
 
             if not self.match(Tokens.SYMBOL, ','):
                 break
 
+        if argument_idx < len(params):
+            self.error("too few arguments, '%s' takes %d" % (procedure_name, len(params)))
+
         return arguments
 
     def assignment_statement(self):
@@ -748,19 +659,8 @@ class Parser:
             raise ParseError("cannot assign expression of type '%s' to destination of type '%s'" % (exp_type, dest_type), self.prev_token)
 
         self.get_symbol(dest_name).current_reg = exp_addr
-        self.get_symbol(dest_name).used = True
-
-        if self.get_symbol(dest_name).isglobal:
-            self.gen.move_reg_to_mem_global(exp_addr, dest_addr, offset_reg=offset_reg)
-            return True
 
-        if self.get_symbol(dest_name).indirect:
-            r = self.gen.set_new_reg("M[FP + %d]" % dest_addr)
-            if offset_reg:
-                r = self.gen.set_new_reg("R[%d] + R[%d]" % (r, offset_reg))
-            self.gen.move_reg_to_mem_indirect(reg=exp_addr, mem=r)
-        else:
-            self.gen.move_reg_to_mem(reg=exp_addr, mem=dest_addr, offset_reg=offset_reg)
+        self.gen.store(self.get_symbol(dest_name), offset_reg, exp_addr)
 
         return True
 
@@ -795,13 +695,13 @@ class Parser:
                 raise ParseError("expression must evaluate to type boolean")
 
         if not self.match(Tokens.SYMBOL, ')'):
-            self.erro("expected ')' after expression", self.prev_token)
+            self.error("expected ')' after expression", self.prev_token)
 
         if not self.match(Tokens.KEYWORD, 'then'):
             self.error("expected 'then'", self.prev_token)
 
         # if the branch is not taken jump to the else
-        self.gen.write("if(R[%s] == 0) { goto %s; }" % (exp_addr, else_label))
+        self.gen.branch_false(exp_addr, else_label)
 
         # process the body of the if block
         self.statements()
@@ -851,7 +751,7 @@ class Parser:
             if exp_addr is None:
                 raise ParseError("invalid expression")
 
-            self.gen.write("if (R[%d] == 0) { goto %s; }" % (exp_addr, end_label))
+            self.gen.branch_false(exp_addr, end_label)
 
             if not self.match(Tokens.SYMBOL, ')'):
                 raise ParseError("expected closing ')' but found '%r'" % self.token, self.prev_token, after_token=True)
@@ -884,7 +784,7 @@ class Parser:
         if self.match(Tokens.SYMBOL, '['):
 
             if not self.get_symbol(name).isarray:
-                raise ParseError("'%s' is not an array" % name, name_token)
+                raise ParseError("'%s' is not an array" % name, self.prev_token)
 
             offset_addr, type = self.expression()
 
@@ -909,9 +809,9 @@ class Parser:
             rhs_addr, rhs_type = rhs()
             if lhs_type != rhs_type:
                 raise ParseError("expression type error. '%s' and '%s' incompatible." % (lhs_type, rhs_type), self.prev_token)
-            lhs_addr = self.gen.set_new_reg("R[%d] %s R[%d]" % (lhs_addr, operation, rhs_addr))
             if result_is_bool:
                 lhs_type = Tokens.BOOL
+            lhs_addr = self.gen.binop(operation, lhs_addr, rhs_addr, lhs_type)
 
         return (lhs_addr, lhs_type)
 
@@ -927,7 +827,7 @@ class Parser:
         addr, type = self.arith_op()
 
         if hasnot:
-            addr = self.gen.set_new_reg("~R[%d]" % addr)
+            addr = self.gen.unop('~', addr)
 
         return self.operation((addr, type), ('&', '|'), self.arith_op)
 
@@ -1004,40 +904,23 @@ class Parser:
         Numbers
         """
         if self.match(Tokens.INTEGER):
-            addr = self.gen.set_new_reg(self.matched_token.value)
+            addr = self.gen.move(Const(int(self.matched_token.value), Tokens.INTEGER))
             if negate:
-                addr = self.gen.set_new_reg("-1 * R[%d]" % addr)
+                addr = self.gen.unop('-', addr)
             return (addr, self.matched_token.type)
 
         if self.match(Tokens.FLOAT):
+            value = float(self.matched_token.value)
             if negate:
-                self.gen.write("tmp_float = -1 * %s;" % self.matched_token.value)
-            else:
-                self.gen.write("tmp_float = %s;" % self.matched_token.value)
-            r = self.gen.new_reg()
-            self.gen.write("memcpy(&R[%s], &tmp_float, sizeof(float));" % r)
-            return (r, self.matched_token.type)
+                value = -value
+            return (self.gen.move(Const(value, Tokens.FLOAT)), self.matched_token.type)
 
 
         """
         String
         """
         if self.match(Tokens.STRING):
-            symbol = Symbol(self.matched_token.value, self.matched_token.type, size=100)
-            symbol.isstring = True
-            self.add_symbol(symbol)
-
-            for i,c in enumerate(self.matched_token.value):
-                self.gen.write("tmp_string[%s] = '%s';" % (i,c))
-
-            self.gen.write("tmp_string[%s] = '\\0';" % (i+1))
-
-            self.gen.write("memcpy(&M[FP+%s], tmp_string, MAX_STR_LEN);" % symbol.addr)
-
-            self.gen.write("SP = SP + %d;" % symbol.size)
-
-            r = self.gen.set_new_reg("FP + %s" % symbol.addr)
-
+            r = self.gen.string(self.matched_token.value)
             return (r, self.matched_token.type)
 
         """
@@ -1045,10 +928,7 @@ class Parser:
         """
         if self.match(Tokens.BOOL):
             value = self.matched_token.value
-            if value == 'true':
-                addr = self.gen.set_new_reg("1")
-            else:
-                addr = self.gen.set_new_reg("0")
+            addr = self.gen.move(Const(int(value == 'true'), Tokens.BOOL))
             return (addr, Tokens.BOOL)
 
         raise ParseError("expected factor but found '%s'" % self.token.value)
@@ -1082,7 +962,7 @@ class Parser:
         if self.match(Tokens.SYMBOL, '['):
 
             if not self.get_symbol(name).isarray:
-                raise ParseError("'%s' is not an array" % name, name_token)
+                raise ParseError("'%s' is not an array" % name, self.prev_token)
 
             self.gen.comment("getting array '%s' offset" % name)
             offset_reg, type = self.expression()
@@ -1092,22 +972,12 @@ class Parser:
         elif self.get_symbol(name).isarray:
             return (None, None)
 
-        if self.get_symbol(name).isglobal:
-            if offset_reg:
-                addr = self.gen.set_new_reg("M[%d+R[%s]]" % (self.get_symbol(name).addr, offset_reg))
-            else:
-                addr = self.gen.set_new_reg("M[%d]" % self.get_symbol(name).addr)
-        else:
-            if offset_reg:
-                if self.get_symbol(name).indirect:
-                    addr = self.gen.set_new_reg("M[M[FP+%d]+R[%s]]" % (self.get_symbol(name).addr, offset_reg))
-                else:
-                    addr = self.gen.set_new_reg("M[FP+%d+R[%s]]" % (self.get_symbol(name).addr, offset_reg))
-            else:
-                addr = self.gen.set_new_reg("M[FP+%d]" % self.get_symbol(name).addr)
+        self.get_symbol(name).used = True
+
+        addr = self.gen.load(self.get_symbol(name), offset_reg)
 
         if negate:
-            addr = self.gen.set_new_reg("-1 * R[%d]" % addr)
+            addr = self.gen.unop('-', addr)
 
         # keep track of what register contains this symbols value
         self.get_symbol(name).current_reg = addr
@@ -1131,21 +1001,22 @@ if __name__ == "__main__":
     print ""
     print "Global Procedures"
     print "-"*50
-    for x in parser.global_symbols:
-        if not parser.global_symbols[x].type == 'procedure': continue
-        print parser.global_symbols[x]
+    for x in parser.global_symbols.symbols.values():
+        if not x.type == 'procedure': continue
+        print x
 
     print ""
     print "Global Symbols"
     print "-"*50
-    for x in parser.global_symbols:
-        if parser.global_symbols[x].type == 'procedure': continue
-        print parser.global_symbols[x]
+    for x in parser.global_symbols.symbols.values():
+        if x.type == 'procedure': continue
+        print x
 
     print ""
     print "Program:"
     print "-"*50
-    for line in gen.lines:
-        print line
+    for instr in gen.instrs:
+        print instr
 
+    gen.optimize()
     gen.write_file("out.c")
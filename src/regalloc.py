@@ -0,0 +1,85 @@
+from flow import build_blocks, liveness
+
+class RegisterAllocator:
+    """
+    Maps the unbounded virtual registers handed out by Gen onto a small set
+    of C locals r1..rN by coloring the interference graph built from a
+    liveness analysis of the IR. Float registers are colored separately
+    and become float locals f1..fN.
+    """
+
+    def __init__(self, instrs):
+
+        self.instrs = instrs
+        self.colors = {}
+        self.num_regs = 0
+        self.num_float_regs = 0
+
+        # every register is defined exactly once, its type is that of the
+        # instruction defining it
+        self.float_regs = set()
+        for instr in instrs:
+            if instr.dst is not None and instr.dst.type == 'FLOAT':
+                self.float_regs.add(instr.dst.n)
+
+    def interference(self):
+
+        blocks = liveness(build_blocks(self.instrs))
+
+        graph = {}
+
+        for b in blocks:
+            live = set(b.live_out)
+            for instr in reversed(b.instrs):
+                defs = instr.defs
+                uses = instr.uses
+                for d in defs:
+                    graph.setdefault(d, set())
+                    for l in live:
+                        if l == d: continue
+                        graph[d].add(l)
+                        graph.setdefault(l, set()).add(d)
+                live -= defs
+                live |= uses
+                for u in uses:
+                    graph.setdefault(u, set())
+
+        return graph
+
+    def allocate(self):
+        """
+        Greedily colors registers in the order they were created. Returns a
+        dict mapping virtual register numbers to colors.
+        """
+
+        graph = self.interference()
+
+        for reg in sorted(graph):
+            is_float = reg in self.float_regs
+            taken = set(self.colors[n] for n in graph[reg] if n in self.colors and (n in self.float_regs) == is_float)
+            color = 1
+            while color in taken:
+                color += 1
+            self.colors[reg] = color
+            if is_float:
+                self.num_float_regs = max(self.num_float_regs, color)
+            else:
+                self.num_regs = max(self.num_regs, color)
+
+        return self.colors
+
+    def name(self, reg):
+        if reg in self.float_regs:
+            return "f%d" % self.colors[reg]
+        return "r%d" % self.colors[reg]
+
+    def declaration(self):
+        """
+        Returns the C declaration of the allocated registers
+        """
+        decls = []
+        if self.num_regs:
+            decls.append("int %s;" % ", ".join("r%d" % (i+1) for i in range(self.num_regs)))
+        if self.num_float_regs:
+            decls.append("float %s;" % ", ".join("f%d" % (i+1) for i in range(self.num_float_regs)))
+        return " ".join(decls)
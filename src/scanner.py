@@ -1,143 +1,181 @@
 #! /usr/bin/env python
 
-from itertools import izip_longest
-from color import Color
+import re
+import mmap
+from array import array
 from tokens import Tokens
+from diagnostic import Diagnostic
+
+KEYWORDS = frozenset(Tokens.keywords)
+
+# One alternative per kind of token, tried in order at every position. The
+# named group that matched tells token_iter what it found. Longer symbols
+# have to come first so that ':=' is not scanned as ':' followed by '='.
+TOKEN_RE = re.compile(r"""
+      (?P<space>[ \t]+)
+    | (?P<newline>[\n\r])
+    | (?P<comment>//.*)
+    | (?P<symbol>%s)
+    | (?P<name>[a-zA-Z_][a-zA-Z0-9_]*)
+    | (?P<number>[0-9]+\.?[0-9]*|\.[0-9]*)
+    | (?P<string>"[a-zA-Z0-9 _,;:.']*)
+    | (?P<other>.)
+""" % '|'.join(re.escape(x) for x in sorted(Tokens.symbols, key=len, reverse=True)), re.VERBOSE)
 
 class Scanner:
 
-    def __init__(self, filename):
+    def __init__(self, filename, source=None, quiet=False):
+        """
+        Scans the file 'filename' or, if given, the text 'source' in which
+        case filename is only used in diagnostics. If quiet is set errors and
+        warnings are only collected in self.diagnostics, not printed.
+        """
 
         self.filename = filename
-
-        self.f = open(filename)
-        if not self.f:
-            print "Could not open file!"
-            sys.exit(1)
-
+        self.quiet = quiet
+        self.diagnostics = []
+
+        if source is not None:
+            self.source = source
+        else:
+            # the whole file is mapped into memory once and scanned in place,
+            # lines are only ever referred to by their offset into it
+            with open(filename) as f:
+                try:
+                    self.source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    # empty files can not be mapped
+                    self.source = ""
+
+        self.line_offsets = array('L')
         self.line_num = 0
         self.col_num = 0
         self.has_errors = False
+        self.has_warnings = False
 
     def warning(self, message, column=None):
 
-        self.print_message(message, "warning", column, Color.YELLOW)
+        self.has_warnings = True
+        self.print_message(message, "warning", column)
 
     def error(self, message, column=None):
 
         self.has_errors = True
-        self.print_message(message, "error", column, Color.RED)
+        self.print_message(message, "error", column)
 
-    def print_message(self, message, label="info", column=None, color=Color.WHITE):
+    def print_message(self, message, label="info", column=None):
 
         if column is None:
             column = self.col_num
 
-        column -= len(self.line) - len(self.line.lstrip())
+        line = self.line_text(self.line_num)
+
+        column -= len(line) - len(line.lstrip())
 
-        print Color.BOLD + Color.WHITE + "%s:%s:%s: " % (self.filename, self.line_num, column) + color + "%s: " % label + Color.WHITE + message
-        print Color.DEFAULT + self.line.strip()
-        print Color.GREEN + "%s^" % (' '*(column-1)) + Color.DEFAULT
+        self.report(Diagnostic(label, message, self.filename, self.line_num, column, line, column))
 
-    def col_iter(self):
+    def report(self, diagnostic):
         """
-        Returns an iterator that produces the current and next character in the line
-        Example: if the current line is "abc" the iterator will produce:
-            ('a', 'b')
-            ('b', 'c')
-            ('c', None)
-        It also keeps track of the current column number
+        Records a diagnostic of the scanner or the parser and prints it
+        unless the scanner is quiet
         """
-        self.col_num = 0
-        for _ in izip_longest(self.line, self.line[1:]):
-            self.col_num += 1
-            yield _
+        self.diagnostics.append(diagnostic)
+        if not self.quiet:
+            print diagnostic.format()
 
-    def token_iter(self):
+    def line_text(self, line_num):
+        """
+        Returns the text of a line of the source file
+        """
 
-        self.line_num = 0
+        if not 0 < line_num <= len(self.line_offsets):
+            return ""
 
-        for line in self.f:
+        start = self.line_offsets[line_num-1]
+        end = self.source.find('\n', start)
 
-            line = line.lower()
-            self.line = line
-            self.line_num += 1
+        return self.source[start:] if end < 0 else self.source[start:end+1]
 
-            col_iter = self.col_iter()
+    def new_token(self, type, value, column):
+        self.col_num = column
+        return Tokens.Token(type, value, self.line_num, column)
 
-            for char, next_char in col_iter:
+    def token_iter(self):
 
-                # if we see a space just skip it and keep looking
-                if char in [' ', '\t']:
-                    continue
+        source = self.source
+        pos = 0
+        end = len(source)
 
-                # if its a newline insert a special token and then skip it
-                if char in ['\n','\r']:
-                    yield Tokens.Token(self, Tokens.SPECIAL, '\n')
-                    continue
+        self.line_num = 0
 
-                """
-                Comments
-                """
-                if char == "/" and next_char == "/":
+        while pos < end:
 
-                    token = Tokens.Token(self)
-                    token.type = Tokens.COMMENT
+            # offset of the start of the line and the end of the line
+            # including its newline
+            base = pos
+            eol = source.find('\n', pos)
+            eol = end if eol < 0 else eol + 1
 
-                    # consume until end of the line
-                    while next_char:
-                        token.value += char
-                        char, next_char = next(col_iter)
+            self.line_offsets.append(base)
+            self.line_num += 1
 
-                    yield token
+            while pos < eol:
 
-                    continue
+                match = TOKEN_RE.match(source, pos, eol)
+                kind = match.lastgroup
+                value = match.group()
+                start, pos = match.span()
 
-                """
-                Symbols
-                """
+                # columns are counted starting at 1, 'last' is the column of
+                # the last character of the match
+                column = start - base + 1
+                last = pos - base
 
-                if any(x.startswith(char) for x in Tokens.symbols):
+                # if we see a space just skip it and keep looking
+                if kind == 'space':
+                    continue
 
-                    token = Tokens.Token(self)
-                    token.type = Tokens.SYMBOL
-                    token.value = char
+                # if its a newline insert a special token and then skip it
+                if kind == 'newline':
+                    yield self.new_token(Tokens.SPECIAL, '\n', column)
+                    continue
 
-                    while any(x.startswith(token.value+next_char) for x in Tokens.symbols):
-                        token.value += next_char
-                        char, next_char = next(col_iter)
+                # comments consume the rest of the line including the newline
+                if kind == 'comment':
+                    yield self.new_token(Tokens.COMMENT, value, column)
+                    pos = eol
+                    self.col_num = eol - base
+                    break
 
-                    # check to see if the final token value is a valid symbol
-                    if token.value in Tokens.symbols:
-                        yield token
-                        continue
+                if kind == 'symbol':
+                    yield self.new_token(Tokens.SYMBOL, intern(value), column)
+                    continue
 
                 """
                 Keywords and identifiers
                 """
 
-                if char.isalpha() or char == "_":
+                next_char = source[pos:pos+1] if pos < eol else ''
 
-                    token = Tokens.Token(self)
-                    token.value += char
+                if kind == 'name':
 
-                    while next_char.isalnum() or next_char == '_':
-                        token.value += next_char
-                        char, next_char = next(col_iter)
+                    # only identifiers and keywords are case insensitive
+                    value = value.lower()
 
                     if next_char == '"':
-                        self.error("unexpected '\"' after identifier", column=self.col_num+1)
-                        yield Tokens.Token(self, Tokens.INVALID)
+                        self.error("unexpected '\"' after identifier", column=last+1)
+                        yield self.new_token(Tokens.INVALID, "", last)
+                        pos = eol
                         break
 
-                    if token.value in ['true', 'false']:
-                        token.type = Tokens.BOOL
-                    elif token.value in Tokens.keywords:
-                        token.type = Tokens.KEYWORD
+                    if value in ('true', 'false'):
+                        type = Tokens.BOOL
+                    elif value in KEYWORDS:
+                        type = Tokens.KEYWORD
                     else:
-                        token.type = Tokens.IDENTIFIER
+                        type = Tokens.IDENTIFIER
 
-                    yield token
+                    yield self.new_token(type, intern(value), column)
 
                     continue
 
@@ -145,44 +183,38 @@ class Scanner:
                 Numbers
                 """
 
-                if char.isdigit() or char == '.':
+                if kind == 'number':
 
-                    token = Tokens.Token(self)
-                    token.type = Tokens.INTEGER
-                    token.value += char
+                    if value.startswith('.'):
+                        self.warning("number should not start with decimal point, inserting leading '0'", column=column)
+                        value = '0' + value
 
-                    if char == '.':
-                        self.warning("number should not start with decimal point, inserting leading '0'")
-                        token.value = '0' + token.value
-
-                    while next_char.isdigit() or next_char == '.':
-                        token.value += next_char
-                        if token.value.count('.') == 2: break
-                        char, next_char = next(col_iter)
-
-                    if token.value.count('.') == 2:
-                        self.error("too many decimals", column=self.col_num+1)
-                        yield Tokens.Token(self, Tokens.INVALID)
+                    if next_char == '.':
+                        self.error("too many decimals", column=last+1)
+                        yield self.new_token(Tokens.INVALID, "", last)
+                        pos = eol
                         break
 
                     if next_char.isalpha():
-                        self.error("expected number but found '%s'" % next_char, column=self.col_num+1)
-                        yield Tokens.Token(self, Tokens.INVALID)
+                        self.error("expected number but found '%s'" % next_char, column=last+1)
+                        yield self.new_token(Tokens.INVALID, "", last)
+                        pos = eol
                         break
 
                     if next_char == '"':
-                        self.error("unexpected '\"' after number", column=self.col_num+1)
-                        yield Tokens.Token(self, Tokens.INVALID)
+                        self.error("unexpected '\"' after number", column=last+1)
+                        yield self.new_token(Tokens.INVALID, "", last)
+                        pos = eol
                         break
 
-                    if token.value.endswith('.'):
-                        self.warning("number should not end with decimal point, inserting trailing '0'")
-                        token.value += '0'
-
-                    if '.' in token.value:
-                        token.type = Tokens.FLOAT
+                    if value.endswith('.'):
+                        self.warning("number should not end with decimal point, inserting trailing '0'", column=last)
+                        value += '0'
 
-                    yield token
+                    if '.' in value:
+                        yield self.new_token(Tokens.FLOAT, value, column)
+                    else:
+                        yield self.new_token(Tokens.INTEGER, value, column)
 
                     continue
 
@@ -190,37 +222,35 @@ class Scanner:
                 String Literal
                 """
 
-                if char == '"':
-
-                    token = Tokens.Token(self)
-                    token.type = Tokens.STRING
+                if kind == 'string':
 
-                    while next_char.isalnum() or next_char in " _,;:.'":
-                        token.value += next_char
-                        char, next_char = next(col_iter)
-
-                    if next_char in ['\n','\r']:
-                        self.error("unexpected EOL while scanning string literal", column=self.col_num+1)
-                        yield Tokens.Token(self, Tokens.INVALID)
+                    if next_char in ('\n', '\r'):
+                        self.error("unexpected EOL while scanning string literal", column=last+1)
+                        yield self.new_token(Tokens.INVALID, "", last)
+                        pos = eol
                         break
 
-                    if not next_char == '"':
-                        self.error("illegal string character '%s'" % next_char, column=self.col_num+1)
-                        yield Tokens.Token(self, Tokens.INVALID)
+                    if next_char != '"':
+                        self.error("illegal string character '%s'" % (next_char or None), column=last+1)
+                        yield self.new_token(Tokens.INVALID, "", last)
+                        pos = eol
                         break
 
-                    # consume the trailing quotation mark
-                    next(col_iter)
+                    yield self.new_token(Tokens.STRING, value[1:], column)
 
-                    yield token
+                    # consume the trailing quotation mark
+                    pos += 1
 
                     continue
 
-                self.error("unsupported character %r" % char)
-                yield Tokens.Token(self, Tokens.INVALID)
+                self.error("unsupported character %r" % value, column=column)
+                yield self.new_token(Tokens.INVALID, "", column)
+
+            else:
+                self.col_num = eol - base
 
         # return an EOF token since we are done
-        yield Tokens.Token(self, Tokens.SPECIAL, 'EOF')
+        yield self.new_token(Tokens.SPECIAL, 'EOF', self.col_num)
 
 if __name__ == "__main__":
     import sys
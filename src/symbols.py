@@ -0,0 +1,64 @@
+class Scope:
+    """
+    Symbols declared in one scope, keyed by their (interned) name. Names
+    not declared here are looked up in the parent scope. The sizes of the
+    parameters and of the local variables are kept up to date as symbols
+    come and go, so giving a new symbol its address takes constant time.
+
+    The scope of a procedure (or the main program) is also its stack frame:
+    parameters come first, in the order they were declared, followed by the
+    local variables.
+    """
+
+    def __init__(self, parent=None):
+        self.symbols = {}
+        self.parent = parent
+        self.param_size = 0     # in words
+        self.local_size = 0     # in words
+
+    def __contains__(self, name):
+        return self.lookup(name) is not None
+
+    def lookup(self, name):
+        """
+        Returns the symbol called 'name' in this or an enclosing scope, or
+        None if there is none
+        """
+        scope = self
+        while scope is not None:
+            symbol = scope.symbols.get(name)
+            if symbol is not None:
+                return symbol
+            scope = scope.parent
+        return None
+
+    def declare(self, symbol):
+        """
+        Adds a symbol to this scope and places it at the next free address
+        of the frame
+        """
+        # after a syntax error the parser may declare a symbol without a name
+        if isinstance(symbol.name, str):
+            symbol.name = intern(symbol.name)
+        self.symbols[symbol.name] = symbol
+
+        if symbol.type == 'procedure':
+            return
+
+        symbol.addr = self.param_size + self.local_size
+        if symbol.isparam:
+            self.param_size += 1
+        else:
+            self.local_size += symbol.size
+
+    def remove(self, symbol):
+        del self.symbols[symbol.name]
+        if symbol.type == 'procedure':
+            return
+        if symbol.isparam:
+            self.param_size -= 1
+        else:
+            self.local_size -= symbol.size
+
+    def variables(self):
+        return [s for s in self.symbols.values() if s.type != 'procedure']
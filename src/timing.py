@@ -0,0 +1,80 @@
+import time
+import resource
+from contextlib import contextmanager
+
+class Phase:
+
+    def __init__(self, name, unit=''):
+        self.name = name
+        self.unit = unit
+        self.wall = 0.0
+        self.count = None
+        self.grown_kb = None    # growth of the peak memory use
+
+
+class PhaseTimer:
+    """
+    Collects wall time, an item count (tokens, instructions, lines) and how
+    much the peak memory use grew in every phase of a build. The peak only
+    ever goes up, a phase that fits in memory already used shows 0.
+    """
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name, unit='', child=False):
+        """
+        Times the body of the with statement. If 'child' is set the peak
+        memory of child processes (gcc) is measured instead of our own.
+        """
+        p = Phase(name, unit)
+        self.phases.append(p)
+        who = resource.RUSAGE_CHILDREN if child else resource.RUSAGE_SELF
+        peak = resource.getrusage(who).ru_maxrss
+        start = time.time()
+        try:
+            yield p
+        finally:
+            p.wall += time.time() - start
+            p.grown_kb = resource.getrusage(who).ru_maxrss - peak
+
+    def timed(self, iterator, name, unit=''):
+        """
+        Wraps an iterator and accounts the time spent producing its items
+        to a separate phase. Used to split scanning from parsing since the
+        parser pulls tokens from the scanner as it goes.
+        """
+        p = Phase(name, unit)
+        p.count = 0
+        self.phases.append(p)
+
+        def wrapper():
+            clock = time.time
+            while True:
+                start = clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    p.wall += clock() - start
+                    break
+                p.wall += clock() - start
+                p.count += 1
+                yield item
+
+        return wrapper()
+
+    def get(self, name):
+        for p in self.phases:
+            if p.name == name:
+                return p
+
+    def report(self):
+        print "%-10s %10s %10s %-12s %14s" % ("phase", "wall (ms)", "count", "", "peak +KB")
+        print "-"*60
+        for p in self.phases:
+            count = "" if p.count is None else p.count
+            grown = "" if p.grown_kb is None else p.grown_kb
+            print "%-10s %10.1f %10s %-12s %14s" % (p.name, p.wall*1000, count, p.unit, grown)
+        print "-"*60
+        print "%-10s %10.1f" % ("total", sum(p.wall for p in self.phases)*1000)
@@ -45,12 +45,15 @@ class Tokens:
 
     class Token(object):
 
-        def __init__(self, scanner, _type=None, _value=""):
+        # tokens are created by the hundred thousand for big sources so they
+        # only store their position, the text of the line can be looked up
+        # through the scanner (see Scanner.line_text)
+        __slots__ = ('type', 'value', 'line_num', 'col_num')
 
-            self.filename = scanner.filename
-            self.line_str = scanner.line
-            self.line_num = scanner.line_num
-            self.col_num = scanner.col_num
+        def __init__(self, _type, _value, line_num, col_num):
+
+            self.line_num = line_num
+            self.col_num = col_num
             self.value = _value
             self.type = _type
 
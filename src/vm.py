@@ -0,0 +1,438 @@
+"""
+Running programs in process, without gcc.
+
+The IR is assembled into threaded code: every basic block (the code from
+one label up to the next) becomes a python function that does the work of
+its instructions and returns the number of the block to continue with.
+The program is the array of those functions and running it is
+
+    while True:
+        pc = code[pc]()
+
+Memory is a list of words like M[] in the C runtime and frames are laid
+out the same way, the return address pushed by a call is the number of
+the block to return to. Registers are the slots of R[], registers that
+are only used in the block defining them are python locals. Programs
+behave as they do compiled, except that
+
+  - string values are python strings instead of addresses of characters
+    in M[], so strings compare by their contents,
+  - running past the end of the memory or dividing by zero stops the
+    program with an error. Array indices are not checked, as in the C
+    code, and an address below 0 wraps around to the end of the memory
+    the way python list indices do.
+"""
+
+import sys
+import math
+import struct
+
+from ir import *
+from gen import Gen
+from optimize import optimize, int32
+
+# the defaults of the C runtime (see runtime.h)
+MEM_SIZE = 10000
+MAX_STR_LEN = 100
+
+# the procedures of the runtime, called directly instead of through a frame
+BUILTINS = ('putinteger', 'putbool', 'putstring', 'putfloat', 'getinteger', 'getbool', 'getfloat', 'getstring')
+
+_float = struct.Struct('f')
+
+def single(x):
+    """
+    Rounds a python float to the nearest C float
+    """
+    try:
+        return _float.unpack(_float.pack(x))[0]
+    except OverflowError:
+        return x * float('inf')
+
+def divide(lhs, rhs):
+    if rhs == 0:
+        raise RunError("division by zero")
+    # C division truncates towards zero
+    q = abs(lhs) // abs(rhs)
+    return int32(q if (lhs < 0) == (rhs < 0) else -q)
+
+def divide_float(lhs, rhs):
+    if rhs == 0:
+        if lhs == 0 or lhs != lhs:
+            return float('nan')
+        return math.copysign(float('inf'), lhs) * math.copysign(1.0, rhs)
+    return single(lhs / rhs)
+
+
+class RunError(Exception):
+    pass
+
+
+class Halt(Exception):
+    pass
+
+def halt():
+    raise Halt()
+
+
+class Input:
+    """
+    Reads the standard input the way scanf and fgets do in the C runtime
+    """
+
+    def __init__(self, f, max_str_len=MAX_STR_LEN):
+        self.f = f
+        self.max_str_len = max_str_len
+        self.line = ''
+        self.pos = 0
+        self.string = ''    # fgets leaves the buffer alone at the end of the input
+
+    def peek(self):
+        if self.pos == len(self.line):
+            self.line = self.f.readline()
+            self.pos = 0
+        return self.line[self.pos:self.pos+1]
+
+    def take(self, chars):
+        """
+        Consumes the characters in 'chars' up to the first one that is not,
+        returns them
+        """
+        taken = []
+        while True:
+            c = self.peek()
+            if not c or c not in chars:
+                return ''.join(taken)
+            taken.append(c)
+            self.pos += 1
+
+    def skip_space(self):
+        while True:
+            c = self.peek()
+            if not c or not c.isspace():
+                return
+            self.pos += 1
+
+    def sign(self):
+        c = self.peek()
+        if c and c in '+-':
+            self.pos += 1
+            return c
+        return ''
+
+    def get_integer(self):
+        self.skip_space()
+        sign = self.sign()
+        digits = self.take('0123456789')
+        # getInteger in the C runtime returns an uninitialized int when
+        # scanf finds no number, this gives 0
+        if not digits:
+            return 0
+        return int32(int(sign + digits))
+
+    def get_float(self):
+        self.skip_space()
+        text = self.sign() + self.take('0123456789')
+        if self.peek() == '.':
+            self.pos += 1
+            text += '.' + self.take('0123456789')
+        if text.strip('+-.') and self.peek() and self.peek() in 'eE':
+            self.pos += 1
+            exponent = self.sign() + self.take('0123456789')
+            if exponent.strip('+-'):
+                text += 'e' + exponent
+        if not text.strip('+-.'):
+            return 0.0
+        return single(float(text))
+
+    def get_string(self):
+        chars = []
+        while len(chars) < self.max_str_len - 1:
+            c = self.peek()
+            if not c:
+                break
+            chars.append(c)
+            self.pos += 1
+            if c == '\n':
+                break
+        if chars:
+            self.string = ''.join(chars)
+        return self.string
+
+
+class VM(Gen):
+    """
+    Assembles the IR into python functions and runs them (see above)
+    """
+
+    def __init__(self, mem_size=MEM_SIZE, max_str_len=MAX_STR_LEN):
+        Gen.__init__(self)
+        self.mem_size = mem_size
+        self.max_str_len = max_str_len
+        self.blocks = []        # (labels, instrs) of every basic block
+        self.block_of = {}      # label -> number of its block
+        self.local_regs = set()
+        self.program = None     # makes the block functions for fresh memory
+
+    def optimize(self, level=1):
+        # registers are list slots and python locals, there is nothing to
+        # allocate
+        self.instrs = optimize(self.instrs, level)
+
+    """
+    Assembling
+    """
+
+    def expand(self):
+        """
+        Returns the instructions with counted loops turned back into plain
+        compares and jumps
+        """
+        for instr in self.instrs:
+            if isinstance(instr, CountedLoop):
+                yield Move(instr.dst, instr.start)
+                yield Label(instr.label)
+                yield CompareBranch(instr.op, instr.dst, instr.limit, instr.targets[0], False)
+            elif isinstance(instr, EndLoop):
+                yield BinOp(instr.counter, '+', instr.counter, Const(1, 'INTEGER'))
+                yield Jump(instr.targets[0])
+            else:
+                yield instr
+
+    def split_blocks(self):
+        """
+        Splits the code at every label. Blocks are left only at their end
+        and by branches, which the python code of a block can do anywhere.
+        """
+        self.blocks = [([], [])]
+        for instr in self.expand():
+            if isinstance(instr, Label):
+                if self.blocks[-1][1]:
+                    self.blocks.append(([], []))
+                self.blocks[-1][0].append(instr.label)
+            elif not isinstance(instr, Comment):
+                self.blocks[-1][1].append(instr)
+
+        self.block_of = {}
+        for n, (labels, instrs) in enumerate(self.blocks):
+            for label in labels:
+                self.block_of[label] = n
+
+    def find_local_regs(self):
+        """
+        Finds the registers that are set once and only used after that in
+        the same block
+        """
+        defs = {}
+        blocks = {}
+        shared = set()
+
+        for n, (labels, instrs) in enumerate(self.blocks):
+            defined = set()
+            for instr in instrs:
+                for r in instr.uses:
+                    if r not in defined:
+                        shared.add(r)
+                    blocks.setdefault(r, set()).add(n)
+                for r in instr.defs:
+                    defs[r] = defs.get(r, 0) + 1
+                    defined.add(r)
+                    blocks.setdefault(r, set()).add(n)
+
+        self.local_regs = set(r for r in defs if defs[r] == 1 and len(blocks[r]) == 1 and r not in shared)
+
+    def assemble(self):
+        """
+        Compiles the python code of all blocks
+        """
+
+        self.split_blocks()
+        self.find_local_regs()
+
+        lines = ["def program(R, M, S, put, get_integer, get_float, get_string, int32, single, divide, divide_float):"]
+
+        for n, (labels, instrs) in enumerate(self.blocks):
+            body = []
+            for instr in instrs:
+                body.extend(self.lower_instr(instr))
+            body.append("return %d" % (n + 1))
+            lines.append("    def block_%d():" % n)
+            if any('FP' in line for line in body):
+                lines.append("        FP = S[0]")
+            lines.extend("        " + line for line in body)
+
+        lines.append("    return [%s]" % ", ".join("block_%d" % n for n in range(len(self.blocks))))
+
+        namespace = {}
+        exec compile("\n".join(lines) + "\n", "<program>", "exec") in namespace
+        self.program = namespace['program']
+
+    """
+    Running
+    """
+
+    def run(self, stdin=None, stdout=None, stderr=None):
+        """
+        Runs the assembled program, returns the exit status
+        """
+
+        stdin = stdin or sys.stdin
+        stdout = stdout or sys.stdout
+        stderr = stderr or sys.stderr
+
+        R = [0] * self.current_reg
+        M = [0] * self.mem_size
+        S = [0, 0]      # FP, SP
+        io = Input(stdin, self.max_str_len)
+
+        code = self.program(R, M, S, stdout.write, io.get_integer, io.get_float, io.get_string, int32, single, divide, divide_float)
+        code.append(halt)
+        pc = self.block_of['main']
+
+        try:
+            while True:
+                pc = code[pc]()
+        except Halt:
+            return 0
+        except RunError as e:
+            message = str(e)
+        except IndexError:
+            if S[1] >= self.mem_size:
+                message = "stack overflow, the stack ran past the end of memory"
+            else:
+                message = "memory access out of bounds"
+
+        stdout.flush()
+        stderr.write("error: %s\n" % message)
+        return 1
+
+    """
+    Lowering the IR to python, one statement per line
+    """
+
+    def operand(self, x):
+        if isinstance(x, Reg):
+            if x.n in self.local_regs:
+                return "r%d" % x.n
+            return "R[%d]" % x.n
+        if isinstance(x, Addr):
+            return self.address(x.symbol)
+        if x.type == 'FLOAT':
+            value = single(x.value)
+            # repr gives inf and nan, which are not python literals
+            if value != value or value in (float('inf'), float('-inf')):
+                return "float('%r')" % value
+            return repr(value)
+        return repr(x.value)
+
+    def arithmetic(self, dst, value):
+        """
+        Sets dst to the value of the python expression, rounded or wrapped
+        the way the C type of dst would be
+        """
+        d = self.operand(dst)
+        if is_float(dst):
+            yield "%s = single(%s)" % (d, value)
+        else:
+            yield "%s = %s" % (d, value)
+            yield "if not -2147483648 <= %s <= 2147483647: %s = int32(%s)" % (d, d, d)
+
+    def lower_comment(self, instr):
+        return []
+
+    def lower_sourceline(self, instr):
+        return []
+
+    def lower_move(self, instr):
+        yield "%s = %s" % (self.operand(instr.dst), self.operand(instr.src))
+
+    def lower_unop(self, instr):
+        src = self.operand(instr.src)
+        if instr.op == '-' and not is_float(instr.dst):
+            return self.arithmetic(instr.dst, "-%s" % src)
+        return ["%s = %s%s" % (self.operand(instr.dst), instr.op, src)]
+
+    def lower_binop(self, instr):
+        lhs, rhs = self.operand(instr.lhs), self.operand(instr.rhs)
+        if instr.op == '/':
+            divide = "divide_float" if is_float(instr.lhs) else "divide"
+            return ["%s = %s(%s, %s)" % (self.operand(instr.dst), divide, lhs, rhs)]
+        if instr.op in ('+', '-', '*'):
+            return self.arithmetic(instr.dst, "%s %s %s" % (lhs, instr.op, rhs))
+        return ["%s = %s %s %s" % (self.operand(instr.dst), lhs, instr.op, rhs)]
+
+    def lower_load(self, instr):
+        yield "%s = %s" % (self.operand(instr.dst), self.storage(instr.symbol, instr.index))
+
+    def lower_store(self, instr):
+        yield "%s = %s" % (self.storage(instr.symbol, instr.index), self.operand(instr.src))
+
+    def lower_string(self, instr):
+        yield "%s = %r" % (self.operand(instr.dst), instr.value)
+
+    def lower_jump(self, instr):
+        yield "return %d" % self.block_of[instr.targets[0]]
+
+    def lower_branchfalse(self, instr):
+        yield "if not %s: return %d" % (self.operand(instr.cond), self.block_of[instr.targets[0]])
+
+    def lower_comparebranch(self, instr):
+        cond = "%s %s %s" % (self.operand(instr.lhs), instr.op, self.operand(instr.rhs))
+        if not instr.when:
+            cond = "not (%s)" % cond
+        yield "if %s: return %d" % (cond, self.block_of[instr.targets[0]])
+
+    def lower_copyarray(self, instr):
+        i = self.operand(instr.dst)
+        end = self.operand(instr.limit)
+        if instr.op == '<=':
+            end = "%s + 1" % end
+        dst, src = self.address(instr.dst_symbol), self.address(instr.src_symbol)
+        yield "%s = %s" % (i, self.operand(instr.start))
+        yield "if %s < %s: M[%s+%s:%s+%s] = M[%s+%s:%s+%s]; %s = %s" % (i, end, dst, i, dst, end, src, i, src, end, i, end)
+
+    def lower_call(self, instr):
+
+        if instr.symbol.label in BUILTINS:
+            for line in self.builtin(instr.symbol.label, instr.args[0]):
+                yield line
+            return
+
+        yield "sp = S[1]"
+        yield "M[sp] = %d" % self.block_of[instr.return_label]
+        yield "M[sp+1] = FP"
+        for k, arg in enumerate(instr.args):
+            yield "M[sp+%d] = %s" % (k + 2, self.operand(arg))
+        yield "S[0] = sp + 2"
+        yield "S[1] = sp + %d" % (len(instr.args) + 2)
+        yield "return %d" % self.block_of[instr.symbol.label]
+
+    def builtin(self, name, arg):
+        x = self.operand(arg)
+        if name == 'putinteger':
+            yield "put('%%d' %% %s)" % x
+        elif name == 'putbool':
+            yield "put('true' if %s else 'false')" % x
+        elif name == 'putstring':
+            # a string variable that was never set is 0
+            yield "put(%s or '')" % x
+        elif name == 'putfloat':
+            yield "put('%%f' %% %s)" % x
+        elif name == 'getfloat':
+            yield "M[%s] = get_float()" % x
+        elif name == 'getstring':
+            yield "M[%s] = get_string()" % x
+        else:
+            yield "M[%s] = get_integer()" % x
+
+    def lower_enter(self, instr):
+        if instr.globals:
+            yield "FP = S[0] = %d" % instr.globals.local_size
+            yield "S[1] = FP + %d" % instr.frame.local_size
+        elif instr.frame.local_size > 0:
+            yield "S[1] += %d" % instr.frame.local_size
+
+    def lower_return(self, instr):
+        yield "S[0] = M[FP-1]"
+        yield "S[1] -= %d" % (instr.frame.local_size + instr.frame.param_size + 2)
+        yield "return M[FP-2]"